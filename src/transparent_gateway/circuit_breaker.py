@@ -1,9 +1,32 @@
+import random
 import time
-from typing import Callable
+from enum import IntEnum
+from typing import Callable, Iterable
+
+
+class _State(IntEnum):
+    """熔断器状态"""
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+# (状态, 连续失败次数, 熔断时刻)
+_Snapshot = tuple[_State, int, float]
+
+_CLOSED: _Snapshot = (_State.CLOSED, 0, 0.0)
 
 
 class CircuitBreaker:
-    """熔断器实现，支持连续失败阈值"""
+    """熔断器实现，支持连续失败阈值和半开探测
+
+    状态流转：CLOSED -(连续失败达到阈值)-> OPEN -(超时)-> HALF_OPEN，
+    HALF_OPEN 下按 probe_probability 放行探测请求，成功则 CLOSED，失败则重新 OPEN。
+
+    状态、失败计数和熔断时刻打包在一个不可变元组中，每次状态切换
+    只做一次属性赋值，避免多个字段之间出现中间状态。
+    """
 
     def __init__(
         self,
@@ -11,58 +34,99 @@ class CircuitBreaker:
         failure_threshold: int = 5,
         on_auto_reset: Callable[[str], None] | None = None,
         name: str = "",
+        probe_probability: float = 1.0,
+        on_state_change: Callable[[str, bool], None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
     ):
         self.timeout = timeout
         self.failure_threshold = failure_threshold
+        self.probe_probability = probe_probability
         self._on_auto_reset = on_auto_reset
+        self._on_state_change = on_state_change
         self._name = name
-        self._tripped_at: float | None = None
-        self._failure_count: int = 0
-
-    def is_open(self) -> bool:
-        """检查熔断器是否处于打开状态（不可用）"""
-        if self._tripped_at is None:
-            return False
-        elapsed = time.time() - self._tripped_at
-        if elapsed >= self.timeout:
-            # 熔断时间已过，自动恢复
-            self._tripped_at = None
-            self._failure_count = 0
+        self._clock = clock  # 单调时钟，测试中可替换为假时钟
+        self._state: _Snapshot = _CLOSED
+
+    def _set(self, snapshot: _Snapshot) -> None:
+        """写入新状态，是否关闭发生变化时回调 on_state_change(name, closed)"""
+        was_closed = self._state[0] is _State.CLOSED
+        self._state = snapshot
+        closed = snapshot[0] is _State.CLOSED
+        if closed != was_closed and self._on_state_change:
+            self._on_state_change(self._name, closed)
+
+    def _current(self) -> _Snapshot:
+        """返回当前状态，熔断超时后切换到半开状态"""
+        snapshot = self._state
+        state, count, tripped_at = snapshot
+        if state is _State.OPEN and self._clock() - tripped_at >= self.timeout:
+            snapshot = self._state = (_State.HALF_OPEN, count, tripped_at)
             if self._on_auto_reset:
                 self._on_auto_reset(self._name)
+        return snapshot
+
+    def is_open(self) -> bool:
+        """检查熔断器是否处于打开状态（不可用）
+
+        半开状态下按 probe_probability 概率放行一次探测。
+        """
+        state = self._current()[0]
+        if state is _State.CLOSED:
             return False
+        if state is _State.HALF_OPEN:
+            return random.random() >= self.probe_probability
         return True
 
-    def record_failure(self) -> None:
-        """记录一次失败，连续失败达到阈值时触发熔断"""
-        self._failure_count += 1
-        if self._failure_count >= self.failure_threshold:
-            self._tripped_at = time.time()
-
-    def record_success(self) -> None:
-        """记录一次成功，重置失败计数"""
-        self._failure_count = 0
+    def record_failure(self) -> bool:
+        """记录一次失败，连续失败达到阈值或半开探测失败时触发熔断
+
+        返回熔断器是否因此从非打开状态进入打开状态。
+        """
+        state, count, tripped_at = self._current()
+        count += 1
+        if state is _State.HALF_OPEN or count >= self.failure_threshold:
+            self._set((_State.OPEN, count, self._clock()))
+            return state is not _State.OPEN
+        self._state = (state, count, tripped_at)
+        return False
+
+    def record_success(self) -> bool:
+        """记录一次成功，重置失败计数并关闭熔断器
+
+        返回熔断器是否因此从打开/半开状态恢复。
+        """
+        state = self._state[0]
+        if state is _State.CLOSED:
+            self._state = _CLOSED
+            return False
+        self._set(_CLOSED)
+        return True
 
     def trip(self) -> None:
         """立即触发熔断（保留用于向后兼容）"""
-        self._tripped_at = time.time()
+        self._set((_State.OPEN, self._state[1], self._clock()))
 
     def reset(self) -> None:
         """重置熔断器（手动恢复）"""
-        self._tripped_at = None
-        self._failure_count = 0
+        self._set(_CLOSED)
 
     def remaining_time(self) -> float | None:
         """返回熔断剩余时间（秒），如果未熔断返回 None"""
-        if self._tripped_at is None:
+        state, _, tripped_at = self._current()
+        if state is _State.CLOSED:
             return None
-        remaining = self.timeout - (time.time() - self._tripped_at)
+        remaining = self.timeout - (self._clock() - tripped_at)
         return max(0, remaining)
 
+    @property
+    def state(self) -> str:
+        """返回当前状态名称：closed / open / half_open"""
+        return self._current()[0].name.lower()
+
     @property
     def failure_count(self) -> int:
         """返回当前连续失败次数"""
-        return self._failure_count
+        return self._state[1]
 
 
 class CircuitBreakerManager:
@@ -73,28 +137,57 @@ class CircuitBreakerManager:
         timeout: int,
         failure_threshold: int = 5,
         on_auto_reset: Callable[[str], None] | None = None,
+        probe_probability: float = 1.0,
+        provider_names: Iterable[str] = (),
+        clock: Callable[[], float] = time.monotonic,
     ):
         self.timeout = timeout
         self.failure_threshold = failure_threshold
+        self.probe_probability = probe_probability
         self._on_auto_reset = on_auto_reset
-        self._breakers: dict[str, CircuitBreaker] = {}
+        self._clock = clock
+        # 未处于关闭状态（打开或半开）的供应商，供选择逻辑快速判断
+        self._not_closed: set[str] = set()
+        # 已知的供应商预先创建熔断器，get() 只需一次字典查找
+        self._breakers: dict[str, CircuitBreaker] = {
+            name: self._create(name) for name in provider_names
+        }
+
+    def _create(self, provider_name: str) -> CircuitBreaker:
+        return CircuitBreaker(
+            self.timeout,
+            self.failure_threshold,
+            self._on_auto_reset,
+            provider_name,
+            self.probe_probability,
+            self._on_state_change,
+            self._clock,
+        )
+
+    def _on_state_change(self, provider_name: str, closed: bool) -> None:
+        if closed:
+            self._not_closed.discard(provider_name)
+        else:
+            self._not_closed.add(provider_name)
+
+    @property
+    def open_count(self) -> int:
+        """未处于关闭状态（打开或半开）的熔断器数量"""
+        return len(self._not_closed)
 
     def get(self, provider_name: str) -> CircuitBreaker:
-        """获取指定供应商的熔断器"""
-        if provider_name not in self._breakers:
-            self._breakers[provider_name] = CircuitBreaker(
-                self.timeout,
-                self.failure_threshold,
-                self._on_auto_reset,
-                provider_name,
-            )
-        return self._breakers[provider_name]
+        """获取指定供应商的熔断器（未知供应商时按需创建）"""
+        breaker = self._breakers.get(provider_name)
+        if breaker is None:
+            breaker = self._breakers[provider_name] = self._create(provider_name)
+        return breaker
 
     def status(self) -> dict[str, dict]:
         """返回所有熔断器的状态"""
         return {
             name: {
-                "is_open": breaker.is_open(),
+                "state": breaker.state,
+                "is_open": breaker.state == "open",
                 "failure_count": breaker.failure_count,
                 "remaining_time": breaker.remaining_time(),
             }
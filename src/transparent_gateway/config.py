@@ -1,10 +1,17 @@
 import os
 import threading
-from dataclasses import dataclass
+import warnings
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:  # PyYAML 未编译 libyaml 扩展
+    from yaml import SafeLoader as _SafeLoader
+    warnings.warn("libyaml 不可用，配置解析回退到纯 Python SafeLoader", RuntimeWarning)
+
 
 @dataclass
 class Provider:
@@ -20,12 +27,23 @@ class CircuitBreakerConfig:
     probe_probability: float = 0.05
 
 
+@dataclass
+class HttpConfig:
+    http2: bool = True
+    max_connections: int = 500
+    max_keepalive_connections: int = 100
+    keepalive_expiry: float = 30.0
+
+
 @dataclass
 class Config:
     access_token: str
     timeout: float
     circuit_breaker: CircuitBreakerConfig
     providers: list[Provider]
+    http: HttpConfig = field(default_factory=HttpConfig)
+    max_body_size: int = 32 * 1024 * 1024  # 0 表示不限制
+    hedge_delay_ms: int = 0  # 0 表示不对冲
 
 
 def load_config(config_path: str | None = None) -> Config:
@@ -36,11 +54,16 @@ def load_config(config_path: str | None = None) -> Config:
     if not path.exists():
         raise FileNotFoundError(f"Config not found: {config_path}")
 
-    with open(path, encoding="utf-8") as f:
-        data = yaml.safe_load(f)
+    return load_config_from_string(path.read_text(encoding="utf-8"))
+
+
+def load_config_from_string(text: str) -> Config:
+    """从 YAML 文本解析配置，load_config 读取文件后调用此函数"""
+    data = yaml.load(text, Loader=_SafeLoader)
 
     gw = data.get("gateway", {})
     cb = gw.get("circuit_breaker", {})
+    http = gw.get("http", {})
 
     providers = [
         Provider(p["name"], p["base_url"].rstrip("/"), p["token"])
@@ -52,12 +75,20 @@ def load_config(config_path: str | None = None) -> Config:
     return Config(
         access_token=gw.get("access_token", ""),
         timeout=gw.get("timeout", 60.0),
+        max_body_size=gw.get("max_body_size", 32 * 1024 * 1024),
+        hedge_delay_ms=gw.get("hedge_delay_ms", 0),
         circuit_breaker=CircuitBreakerConfig(
             failure_threshold=cb.get("failure_threshold", 5),
             reset_timeout=cb.get("reset_timeout", 600),
             probe_probability=cb.get("probe_probability", 0.05),
         ),
         providers=providers,
+        http=HttpConfig(
+            http2=http.get("http2", True),
+            max_connections=http.get("max_connections", 500),
+            max_keepalive_connections=http.get("max_keepalive_connections", 100),
+            keepalive_expiry=http.get("keepalive_expiry", 30.0),
+        ),
     )
 
 
@@ -75,6 +106,15 @@ def get_config() -> Config:
     return _config
 
 
+def init_config(config_path: str | None = None) -> Config:
+    """启动时加载全局配置，避免首个请求才读取配置文件"""
+    global _config
+    config = load_config(config_path)
+    with _config_lock:
+        _config = config
+    return config
+
+
 def reset_config() -> None:
     """重置全局配置（仅用于测试）"""
     global _config
@@ -1,29 +1,46 @@
-import json
 import logging
+import secrets
 import sys
 import threading
-import uuid
 from contextvars import ContextVar
-from datetime import datetime
+from datetime import datetime, timezone
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from typing import Any
 
+import orjson
+
 # 请求上下文，用于追踪单个请求
 request_id_var: ContextVar[str] = ContextVar("request_id", default="")
 
 
 def generate_request_id() -> str:
-    """生成请求 ID"""
-    return uuid.uuid4().hex[:8]
+    """生成请求 ID（8 位十六进制，只需 4 字节随机数）"""
+    return secrets.token_hex(4)
 
 
 class StructuredFormatter(logging.Formatter):
     """结构化 JSON 日志格式化器"""
 
+    def __init__(self) -> None:
+        super().__init__()
+        # (毫秒时间戳, 格式化结果)，同一毫秒内的日志复用时间戳字符串
+        self._ts_cache: tuple[int, str] = (-1, "")
+
+    def _format_ts(self, created: float) -> str:
+        """将记录创建时间格式化为毫秒精度的 ISO 8601 UTC 字符串"""
+        ms = int(created * 1000)
+        cached_ms, cached = self._ts_cache
+        if ms == cached_ms:
+            return cached
+        ts = datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat(timespec="milliseconds")
+        ts = ts[:-6] + "Z"  # "+00:00" -> "Z"
+        self._ts_cache = (ms, ts)
+        return ts
+
     def format(self, record: logging.LogRecord) -> str:
         log_data = {
-            "ts": datetime.utcnow().isoformat() + "Z",
+            "ts": self._format_ts(record.created),
             "level": record.levelname,
             "logger": record.name,
             "msg": record.getMessage(),
@@ -42,7 +59,7 @@ class StructuredFormatter(logging.Formatter):
         if record.exc_info:
             log_data["exception"] = self.formatException(record.exc_info)
 
-        return json.dumps(log_data, ensure_ascii=False)
+        return orjson.dumps(log_data, default=str).decode()
 
 
 class GatewayLogger:
@@ -50,11 +67,17 @@ class GatewayLogger:
 
     def __init__(self, logger: logging.Logger):
         self._logger = logger
+        self._enabled_for = logger.isEnabledFor
 
     def _log(self, level: int, msg: str, **fields: Any) -> None:
-        """内部日志方法"""
-        extra = {"extra_fields": fields} if fields else {}
-        self._logger.log(level, msg, extra=extra)
+        """内部日志方法，级别未启用时直接返回"""
+        if not self._enabled_for(level):
+            return
+        self._emit(level, msg, fields)
+
+    def _emit(self, level: int, msg: str, fields: dict[str, Any]) -> None:
+        """输出一条日志，调用方已检查过级别；fields 直接作为 extra_fields，不再复制"""
+        self._logger.log(level, msg, extra={"extra_fields": fields} if fields else None)
 
     def info(self, msg: str, **fields: Any) -> None:
         self._log(logging.INFO, msg, **fields)
@@ -78,14 +101,15 @@ class GatewayLogger:
         stream: bool = False,
     ) -> None:
         """记录请求开始"""
-        self.info(
-            "request_start",
-            method=method,
-            path=path,
-            query=query,
-            model=model,
-            stream=stream,
-        )
+        if not self._enabled_for(logging.INFO):
+            return
+        self._emit(logging.INFO, "request_start", {
+            "method": method,
+            "path": path,
+            "query": query,
+            "model": model,
+            "stream": stream,
+        })
 
     def request_forward(
         self,
@@ -95,37 +119,49 @@ class GatewayLogger:
         probe: bool = False,
     ) -> None:
         """记录请求转发"""
-        self.info(
-            "request_forward",
-            provider=provider,
-            target_url=target_url,
-            attempt=attempt,
-            probe=probe,
-        )
+        if not self._enabled_for(logging.INFO):
+            return
+        self._emit(logging.INFO, "request_forward", {
+            "provider": provider,
+            "target_url": target_url,
+            "attempt": attempt,
+            "probe": probe,
+        })
 
     def request_success(
         self,
         provider: str,
         status_code: int,
         duration_ms: float,
+        http_version: str | None = None,
     ) -> None:
         """记录请求成功"""
-        self.info(
-            "request_success",
-            provider=provider,
-            status=status_code,
-            duration_ms=round(duration_ms, 2),
-        )
+        if not self._enabled_for(logging.INFO):
+            return
+        self._emit(logging.INFO, "request_success", {
+            "provider": provider,
+            "status": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "http_version": http_version,
+        })
 
     def request_failure(
         self,
         provider: str,
         error_type: str,
-        error_msg: str,
+        error_msg: str | bytes,
         status_code: int | None = None,
         duration_ms: float | None = None,
     ) -> None:
-        """记录请求失败"""
+        """记录请求失败
+
+        error_msg 可以直接传入上游响应体（bytes），只在日志确实输出时
+        截取前 200 字节解码，避免对整个错误页做 UTF-8 解码。
+        """
+        if not self._enabled_for(logging.ERROR):
+            return
+        if isinstance(error_msg, bytes):
+            error_msg = error_msg[:200].decode(errors="replace")
         fields: dict[str, Any] = {
             "provider": provider,
             "error_type": error_type,
@@ -135,7 +171,7 @@ class GatewayLogger:
             fields["status"] = status_code
         if duration_ms is not None:
             fields["duration_ms"] = round(duration_ms, 2)
-        self.error("request_failure", **fields)
+        self._emit(logging.ERROR, "request_failure", fields)
 
     def circuit_breaker_event(
         self,
@@ -144,10 +180,12 @@ class GatewayLogger:
         failure_count: int | None = None,
     ) -> None:
         """记录熔断器事件"""
+        if not self._enabled_for(logging.WARNING):
+            return
         fields: dict[str, Any] = {"provider": provider, "action": action}
         if failure_count is not None:
             fields["failure_count"] = failure_count
-        self.warning("circuit_breaker", **fields)
+        self._emit(logging.WARNING, "circuit_breaker", fields)
 
 
 def setup_logging(
@@ -216,6 +254,15 @@ def get_logger() -> GatewayLogger:
     return _gateway_logger
 
 
+def init_logger(**kwargs: Any) -> GatewayLogger:
+    """启动时配置日志系统并设为全局实例，参数同 setup_logging"""
+    global _gateway_logger
+    logger = setup_logging(**kwargs)
+    with _gateway_logger_lock:
+        _gateway_logger = logger
+    return logger
+
+
 def reset_logger() -> None:
     """重置全局日志实例（仅用于测试）"""
     global _gateway_logger
@@ -1,13 +1,26 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 
-from transparent_gateway.proxy import proxy_request, get_breaker_manager
-from transparent_gateway.config import get_config
-from transparent_gateway.logging_config import setup_logging
+from transparent_gateway.proxy import proxy_request, get_breaker_manager, get_http_client, close_http_client
+from transparent_gateway.config import get_config, init_config
+from transparent_gateway.logging_config import init_logger
 
 # 初始化日志系统
-setup_logging()
+init_logger()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时加载配置并创建上游连接池，关闭时释放连接"""
+    init_config()
+    app.state.http_client = get_http_client()
+    yield
+    app.state.http_client = None
+    await close_http_client()
+
 
-app = FastAPI(title="Transparent Gateway")
+app = FastAPI(title="Transparent Gateway", lifespan=lifespan)
 
 
 @app.get("/_health")
@@ -1,28 +1,77 @@
-import json
+import asyncio
+import hmac
+import http.cookiejar
 import random
+import re
 import threading
 import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Sequence
+from dataclasses import dataclass
 
 import httpx
+import orjson
 from fastapi import Request, Response
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 from transparent_gateway.circuit_breaker import CircuitBreaker, CircuitBreakerManager
 from transparent_gateway.config import Config, Provider, get_config
 from transparent_gateway.logging_config import GatewayLogger, generate_request_id, get_logger, request_id_var
 
-HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
-              "te", "trailers", "transfer-encoding", "upgrade", "host",
-              "content-length", "content-encoding"}
+HOP_BY_HOP: frozenset[str] = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host",
+    "content-length", "content-encoding",
+})
+
+
+# 可携带网关 token 的请求头（Starlette 请求头键均为小写）
+AUTH_HEADERS: frozenset[str] = frozenset({"authorization", "x-api-key"})
+
+# 与 request.headers.raw 直接比较用的字节串版本
+HOP_BY_HOP_BYTES: frozenset[bytes] = frozenset(h.encode() for h in HOP_BY_HOP)
+AUTH_HEADERS_BYTES: frozenset[bytes] = frozenset(h.encode() for h in AUTH_HEADERS)
+
+# 透传未解码的原始响应体时必须保留 content-encoding
+RAW_RESPONSE_HOP_BY_HOP: frozenset[bytes] = HOP_BY_HOP_BYTES - {b"content-encoding"}
+
+# 固定的错误响应：发送时只读取 body 和 raw_headers，可跨请求复用同一个对象
+_RESP_UNAUTHORIZED = Response(b'{"error":"Unauthorized"}', 401, media_type="application/json")
+_RESP_TOO_LARGE = Response(b'{"error":"Payload Too Large"}', 413, media_type="application/json")
+_RESP_BAD_GATEWAY = Response(b'{"error":"Bad Gateway"}', 502, media_type="application/json")
+
+# 不超过此长度的上游响应整体读取后返回，更大的或长度未知的流式透传
+BUFFER_LIMIT = 64 * 1024
+
+# 请求体字段扫描（见 parse_body）
+_JSON_OBJECT_RE = re.compile(rb'[ \t\r\n]*\{')
+_STREAM_RE = re.compile(rb'"stream"\s*:\s*true\b')
+_MODEL_RE = re.compile(rb'"model"\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)"')
 
 _breaker_manager: CircuitBreakerManager | None = None
 _breaker_manager_lock = threading.Lock()
 
+_http_client: httpx.AsyncClient | None = None
+_http_client_lock = threading.Lock()
+
+
+@dataclass(slots=True)
+class ProviderSlot:
+    """路由表中的一项：供应商及其预先绑定的熔断器"""
+    idx: int
+    provider: Provider
+    breaker: CircuitBreaker
+    is_last: bool  # 保底供应商，永不熔断
+    token: bytes  # 供应商 token 的字节串，转发时直接替换进认证头
 
-def _log_circuit_auto_reset(provider_name: str) -> None:
-    """熔断器自动恢复时的日志回调"""
+
+_routes_cache: tuple[Config, CircuitBreakerManager, tuple[ProviderSlot, ...]] | None = None
+
+
+def _log_circuit_half_open(provider_name: str) -> None:
+    """熔断超时进入半开状态时的日志回调"""
     logger = get_logger()
-    logger.circuit_breaker_event(provider_name, "auto_reset")
+    logger.circuit_breaker_event(provider_name, "half_open")
 
 
 def get_breaker_manager() -> CircuitBreakerManager:
@@ -35,7 +84,9 @@ def get_breaker_manager() -> CircuitBreakerManager:
                 _breaker_manager = CircuitBreakerManager(
                     config.circuit_breaker.reset_timeout,
                     config.circuit_breaker.failure_threshold,
-                    on_auto_reset=_log_circuit_auto_reset,
+                    on_auto_reset=_log_circuit_half_open,
+                    probe_probability=config.circuit_breaker.probe_probability,
+                    provider_names=[p.name for p in config.providers],
                 )
     return _breaker_manager
 
@@ -54,77 +105,267 @@ def set_breaker_manager(manager: CircuitBreakerManager) -> None:
         _breaker_manager = manager
 
 
-def filter_headers(headers: dict) -> dict:
-    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP}
+def _reject_all_cookie_jar() -> http.cookiejar.CookieJar:
+    """不接受任何 cookie 的 cookie jar"""
+    return http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的上游 HTTP 客户端（线程安全的单例）
+
+    所有请求复用同一个连接池，避免每次转发都重新建立 TCP/TLS 连接；
+    启用 HTTP/2 时同一供应商的并发请求复用一条连接。
+
+    客户端在所有下游请求间共享，cookie jar 必须拒绝一切 cookie：
+    上游的 Set-Cookie 只透传给当前客户端，不能被保存后附加到其他客户端的请求上。
+
+    响应体按原始字节透传，因此默认 accept-encoding 设为 identity，代替 httpx
+    自带的 gzip/deflate：只有下游客户端自己声明了 Accept-Encoding（随请求头
+    转发并覆盖默认值）时，上游才会返回压缩内容。
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                config = get_config()
+                http_cfg = config.http
+                _http_client = httpx.AsyncClient(
+                    timeout=config.timeout,
+                    headers={"accept-encoding": "identity"},
+                    cookies=_reject_all_cookie_jar(),
+                    http2=http_cfg.http2,
+                    limits=httpx.Limits(
+                        max_keepalive_connections=http_cfg.max_keepalive_connections,
+                        max_connections=http_cfg.max_connections,
+                        keepalive_expiry=http_cfg.keepalive_expiry,
+                    ),
+                )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """关闭共享的上游 HTTP 客户端（应用关闭时调用）"""
+    global _http_client
+    with _http_client_lock:
+        client, _http_client = _http_client, None
+    if client is not None:
+        await client.aclose()
+
+
+def reset_http_client() -> None:
+    """丢弃共享的上游 HTTP 客户端（仅用于测试）"""
+    global _http_client
+    with _http_client_lock:
+        _http_client = None
+
+
+def build_provider_slots(
+    providers: Sequence[Provider], breaker_mgr: CircuitBreakerManager
+) -> tuple[ProviderSlot, ...]:
+    """按优先级为每个供应商绑定熔断器，最后一个标记为保底"""
+    last = len(providers) - 1
+    return tuple(
+        ProviderSlot(i, p, breaker_mgr.get(p.name), i == last, p.token.encode())
+        for i, p in enumerate(providers)
+    )
+
+
+def get_provider_routes(
+    config: Config, breaker_mgr: CircuitBreakerManager
+) -> tuple[ProviderSlot, ...]:
+    """返回供应商路由表
+
+    供应商列表和熔断器在配置生效期间不变，预先绑定后转发循环
+    无需每次按名称查找熔断器。配置或熔断器管理器被替换时自动重建。
+    """
+    global _routes_cache
+    cache = _routes_cache
+    if cache is None or cache[0] is not config or cache[1] is not breaker_mgr:
+        cache = _routes_cache = (config, breaker_mgr, build_provider_slots(config.providers, breaker_mgr))
+    return cache[2]
+
+
+def filter_headers(
+    headers: httpx.Headers, hop_by_hop: frozenset[bytes] = HOP_BY_HOP_BYTES
+) -> list[tuple[bytes, bytes]]:
+    """过滤上游响应的逐跳头，返回可直接写入 ASGI 响应的 (键, 值) 列表
+
+    httpx 的 .raw 保留原始大小写，这里每个键最多做一次字节串小写化
+    （HTTP/2 响应头已是小写，islower() 检查后直接复用，不再分配新对象），
+    不解码为 str，重复的响应头（如 Set-Cookie）逐条保留。
+    """
+    return [
+        (kl, v) for k, v in headers.raw
+        if (kl := k if k.islower() else k.lower()) not in hop_by_hop
+    ]
 
 
-def replace_token(headers: dict, old: str, new: str) -> dict:
+def replace_token(headers: dict[str, str], old: str, new: str) -> dict[str, str]:
+    """将认证头（Authorization / X-API-Key）中的网关 token 替换为供应商 token"""
     if not old:
         return headers
-    return {k: v.replace(old, new) if old in v else v for k, v in headers.items()}
+    return {
+        k: v.replace(old, new) if k.lower() in AUTH_HEADERS and old in v else v
+        for k, v in headers.items()
+    }
 
 
-def check_auth(headers: dict, token: str) -> bool:
+def build_forward_headers(
+    raw_headers: Iterable[tuple[bytes, bytes]], access_token: bytes, provider_token: bytes
+) -> list[tuple[bytes, bytes]]:
+    """构建转发给供应商的请求头
+
+    直接遍历 Starlette 的 request.headers.raw（键已是小写字节串），
+    一次完成逐跳头过滤和认证头中的 token 替换，全程不做 str 解码。
+    返回的 (键, 值) 列表可直接交给 httpx，重复的请求头也会原样保留。
+    """
+    if not access_token:
+        return [(k, v) for k, v in raw_headers if k not in HOP_BY_HOP_BYTES]
+    return [
+        (k, v.replace(access_token, provider_token) if k in AUTH_HEADERS_BYTES and access_token in v else v)
+        for k, v in raw_headers
+        if k not in HOP_BY_HOP_BYTES
+    ]
+
+
+def _extract_token(value: bytes) -> bytes:
+    """从认证头取出凭证，去掉可选的 Bearer 前缀"""
+    scheme, _, credential = value.partition(b" ")
+    if credential and scheme.lower() == b"bearer":
+        return credential.strip()
+    return value.strip()
+
+
+def check_auth(raw_headers: Iterable[tuple[bytes, bytes]], token: bytes) -> bool:
+    """验证网关 token，只检查 Authorization 和 X-API-Key 请求头
+
+    直接遍历 request.headers.raw 一次（键已是小写字节串），
+    凭证需与 token 完全一致，使用 hmac.compare_digest 做常量时间比较。
+    """
     if not token:
         return True
-    return any(token in v for v in headers.values())
+    for k, v in raw_headers:
+        if k in AUTH_HEADERS_BYTES and hmac.compare_digest(_extract_token(v), token):
+            return True
+    return False
+
+
+async def read_body(request: Request, limit: int) -> bytes | None:
+    """分块读取请求体，超过 limit 字节时立即停止并返回 None（limit 为 0 不限制）
+
+    声明的 Content-Length 已超限时不读取请求体。故障转移需要向多个供应商
+    重放同一请求体，因此未超限时仍完整缓存一份。
+    """
+    if limit:
+        declared = request.headers.get("content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            return None
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if limit and size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def is_json_content_type(raw_headers: Iterable[tuple[bytes, bytes]]) -> bool:
+    """请求体是否可能是 JSON
+
+    没有 content-type 时按 JSON 处理（部分客户端不带该头）；
+    multipart、表单、二进制等明确的非 JSON 类型直接跳过请求体扫描。
+    """
+    for key, value in raw_headers:
+        if key == b"content-type":
+            return b"json" in value.lower()
+    return True
 
 
 def parse_body(body: bytes) -> tuple[str | None, bool]:
-    """解析请求体以提取 model 和 stream 字段
+    """扫描请求体以提取 model 和 stream 字段
+
+    只做字节级正则匹配，不解析完整 JSON：请求体可能包含很长的 messages，
+    而这里只需要两个顶层字段。model 仅用于日志，stream 误判为 True
+    时流式分支同样能正确转发普通响应。
 
-    返回 (model, is_stream) 元组。解析失败时返回 (None, False)。
+    返回 (model, is_stream) 元组。未匹配到或请求体不是 JSON 对象时
+    返回 (None, False)。
     """
-    if not body:
-        return None, False
-    try:
-        data = json.loads(body)
-        if not isinstance(data, dict):
-            return None, False
-        model = data.get("model")
-        stream = data.get("stream", False)
-        return model, stream is True
-    except (json.JSONDecodeError, UnicodeDecodeError):
+    if not body or not _JSON_OBJECT_RE.match(body):
         return None, False
+    match = _MODEL_RE.search(body)
+    model = _decode_json_string(match.group(1)) if match else None
+    return model, _STREAM_RE.search(body) is not None
+
+
+def _decode_json_string(raw: bytes) -> str:
+    """解码 JSON 字符串字面量的内容，只有包含转义序列时才交给 orjson"""
+    if b"\\" in raw:
+        try:
+            return orjson.loads(b'"' + raw + b'"')
+        except orjson.JSONDecodeError:
+            pass
+    return raw.decode(errors="replace")
 
 
 def select_provider(
-    providers: list[Provider],
+    slots: Sequence[ProviderSlot],
     breaker_mgr: CircuitBreakerManager,
     logger: GatewayLogger,
     probe_probability: float = 0.05,
-) -> tuple[int, Provider, bool]:
+    rng: Callable[[], float] = random.random,
+) -> tuple[ProviderSlot, bool]:
     """选择供应商
 
     策略：
-    1. probe_probability 概率探测一个熔断的供应商（半开）
-    2. 按顺序选择第一个未熔断的供应商
-    3. 最后一个供应商永不熔断（保底）
+    1. 没有熔断器处于打开/半开状态时直接选第一个（常见情况，O(1)）
+    2. probe_probability 概率探测一个熔断的供应商（半开）
+    3. 按顺序选择第一个未熔断的供应商
+    4. 最后一个供应商永不熔断（保底）
 
-    返回 (索引, 供应商, 是否为探测)
+    rng 返回 [0, 1) 的随机数，测试可直接传入固定值。
+    返回 (路由项, 是否为探测)
     """
+    if not breaker_mgr.open_count:
+        return slots[0], False
+
     # 按概率探测熔断的供应商
-    if random.random() < probe_probability:
-        open_providers = [
-            (i, p) for i, p in enumerate(providers[:-1])  # 排除最后一个
-            if breaker_mgr.get(p.name).is_open()
+    if rng() < probe_probability:
+        open_slots = [
+            slot for slot in slots
+            if not slot.is_last and slot.breaker.is_open()  # 排除最后一个
         ]
-        if open_providers:
-            idx, provider = random.choice(open_providers)
-            logger.info("probe_attempt", provider=provider.name)
-            return idx, provider, True  # True = 这是探测请求
+        if open_slots:
+            slot = random.choice(open_slots)
+            logger.info("probe_attempt", provider=slot.provider.name)
+            return slot, True  # True = 这是探测请求
 
     # 正常选择：按顺序找第一个未熔断的
-    for i, provider in enumerate(providers):
-        is_last = (i == len(providers) - 1)
-        breaker = breaker_mgr.get(provider.name)
-
+    for slot in slots:
         # 最后一个供应商永不熔断
-        if is_last or not breaker.is_open():
-            return i, provider, False
+        if slot.is_last or not slot.breaker.is_open():
+            return slot, False
 
     # 不应该到这里，因为最后一个永不熔断
-    return len(providers) - 1, providers[-1], False
+    return slots[-1], False
+
+
+def build_attempt_order(
+    slots: Sequence[ProviderSlot], first: ProviderSlot
+) -> list[ProviderSlot]:
+    """构建尝试顺序：先选中的供应商，再按优先级排列其余未熔断的（保底供应商总在其中）"""
+    order = [first]
+    for slot in slots:
+        if slot is not first and (slot.is_last or not slot.breaker.is_open()):
+            order.append(slot)
+    return order
+
+
+def _fits_buffer(headers: httpx.Headers) -> bool:
+    """上游声明的 Content-Length 不超过 BUFFER_LIMIT 时返回 True"""
+    length = headers.get("content-length")
+    return length is not None and length.isdigit() and int(length) <= BUFFER_LIMIT
 
 
 def _classify_error(exc: httpx.RequestError) -> str:
@@ -142,15 +383,13 @@ def _handle_provider_failure(
     is_last: bool,
     logger: GatewayLogger,
     error_type: str,
-    error_msg: str,
+    error_msg: str | bytes,
     status_code: int | None = None,
     duration_ms: float | None = None,
 ) -> None:
     """统一的供应商故障处理逻辑"""
-    if not is_last:
-        breaker.record_failure()
-        if breaker.is_open():
-            logger.circuit_breaker_event(provider_name, "opened", breaker.failure_count)
+    if not is_last and breaker.record_failure():
+        logger.circuit_breaker_event(provider_name, "opened", breaker.failure_count)
     logger.request_failure(provider_name, error_type, error_msg, status_code, duration_ms)
 
 
@@ -159,78 +398,125 @@ async def proxy_request(request: Request) -> Response | StreamingResponse:
     config = get_config()
     logger = get_logger()
 
-    headers = dict(request.headers)
-    if not check_auth(headers, config.access_token):
+    raw_headers = request.headers.raw
+    access_token = config.access_token.encode()
+    if not check_auth(raw_headers, access_token):
         logger.warning("auth_failed", reason="invalid_token")
-        return Response(b'{"error":"Unauthorized"}', 401, media_type="application/json")
+        return _RESP_UNAUTHORIZED
 
-    body = await request.body()
-    model, is_stream = parse_body(body)
+    body = await read_body(request, config.max_body_size)
+    if body is None:
+        logger.warning("body_too_large", limit=config.max_body_size)
+        return _RESP_TOO_LARGE
+    model, is_stream = parse_body(body) if is_json_content_type(raw_headers) else (None, False)
+
+    # 路径和查询串只取一次，日志与各次转发共用；每个供应商只需加上自己的 base_url
+    url = request.url
+    path, query = url.path, url.query
+    target = f"{path}?{query}" if query else path
 
     logger.request_start(
         method=request.method,
-        path=request.url.path,
-        query=request.url.query or None,
+        path=path,
+        query=query or None,
         model=model,
         stream=is_stream,
     )
 
     breaker_mgr = get_breaker_manager()
-
-    if is_stream:
-        return await _stream_request(request, headers, body, config, breaker_mgr)
-    return await _normal_request(request, headers, body, config, breaker_mgr)
+    # 应用运行时使用启动时挂到 app.state 的共享客户端；脱离应用的请求（如测试）退回全局单例
+    app = getattr(request, "app", None)
+    client = getattr(app.state, "http_client", None) if app else None
+    if client is None:
+        client = get_http_client()
+
+    return await _forward_request(
+        client, request.method, target, raw_headers, access_token, body, config, breaker_mgr,
+        logger, is_stream,
+    )
 
 
 async def _try_provider(
     client: httpx.AsyncClient,
-    request: Request,
-    headers: dict[str, str],
+    method: str,
+    target: str,
+    raw_headers: list[tuple[bytes, bytes]],
+    access_token: bytes,
     body: bytes,
     config: Config,
-    provider: Provider,
-    breaker_mgr: CircuitBreakerManager,
+    slot: ProviderSlot,
     logger: GatewayLogger,
     is_probe: bool,
-) -> tuple[Response | None, bool]:
-    """尝试一个供应商，返回 (Response, success)"""
-    breaker = breaker_mgr.get(provider.name)
-    is_last = provider == config.providers[-1]
+) -> tuple[Response | StreamingResponse | None, bool]:
+    """尝试一个供应商，返回 (Response, success)
 
-    start = time.time()
-    url = f"{provider.base_url}{request.url.path}"
-    if request.url.query:
-        url += f"?{request.url.query}"
+    成功时 Content-Length 不超过 BUFFER_LIMIT 的响应整体读取后以 Response 返回，
+    其余（较大或长度未知）以 StreamingResponse 边收边发；
+    状态码在响应头到达时即可判断，5xx 才读取响应体用于日志。
+    """
+    provider, breaker, is_last = slot.provider, slot.breaker, slot.is_last
 
-    req_headers = replace_token(filter_headers(headers), config.access_token, provider.token)
+    start = time.monotonic_ns()
+    url = provider.base_url + target
+    req_headers = build_forward_headers(raw_headers, access_token, slot.token)
     logger.request_forward(provider.name, url, attempt=1, probe=is_probe)
 
     try:
-        resp = await client.request(
-            request.method, url, headers=req_headers,
-            content=body, timeout=config.timeout
+        resp = await client.send(
+            client.build_request(method, url, headers=req_headers,
+                                 content=body, timeout=config.timeout),
+            stream=True
         )
-        duration = (time.time() - start) * 1000
+        duration = (time.monotonic_ns() - start) / 1_000_000
 
-        if resp.status_code < 500:
-            breaker.record_success()
-            if is_probe:
-                logger.info("probe_success", provider=provider.name)
-            logger.request_success(provider.name, resp.status_code, duration)
-            return Response(resp.content, resp.status_code,
-                          headers=filter_headers(dict(resp.headers))), True
+        if resp.status_code >= 500:
+            try:
+                content = await resp.aread()
+            finally:
+                await resp.aclose()
 
-        # 5xx 错误
-        _handle_provider_failure(
-            breaker, provider.name, is_last, logger,
-            "http_error", resp.content.decode(errors="replace")[:200],
-            resp.status_code, duration
-        )
-        return Response(resp.content, resp.status_code,
-                       headers=filter_headers(dict(resp.headers))), False
+            _handle_provider_failure(
+                breaker, provider.name, is_last, logger,
+                "http_error", content,
+                resp.status_code, duration
+            )
+            response = Response(content, resp.status_code)
+            response.raw_headers.extend(filter_headers(resp.headers))
+            return response, False
+
+        # 已知长度的小响应整体读取后返回，带 Content-Length 且省去逐块转发；
+        # 读取失败时按供应商故障处理，仍可转移到下一个供应商
+        buffered = _fits_buffer(resp.headers)
+        if buffered:
+            try:
+                content = b"".join([chunk async for chunk in resp.aiter_raw()])
+            finally:
+                await resp.aclose()
+
+        if breaker.record_success():
+            logger.circuit_breaker_event(provider.name, "closed")
+        if is_probe:
+            logger.info("probe_success", provider=provider.name)
+        logger.request_success(provider.name, resp.status_code, duration, resp.http_version)
+
+        if buffered:
+            response = Response(content, resp.status_code)
+        else:
+            # 原样透传上游字节（不解压），content-encoding 随响应头一起转发
+            async def stream() -> AsyncIterator[bytes]:
+                try:
+                    async for chunk in resp.aiter_raw():
+                        yield chunk
+                finally:
+                    await resp.aclose()
+
+            # background 保证响应被丢弃（如对冲落败）时也能释放上游连接
+            response = StreamingResponse(stream(), resp.status_code, background=BackgroundTask(resp.aclose))
+        response.raw_headers.extend(filter_headers(resp.headers, RAW_RESPONSE_HOP_BY_HOP))
+        return response, True
 
     except httpx.RequestError as e:
-        duration = (time.time() - start) * 1000
+        duration = (time.monotonic_ns() - start) / 1_000_000
         _handle_provider_failure(
             breaker, provider.name, is_last, logger,
             _classify_error(e), str(e), duration_ms=duration
@@ -238,137 +524,128 @@ async def _try_provider(
         return None, False
 
 
-async def _normal_request(
-    request: Request,
-    headers: dict[str, str],
+async def _hedged_attempt(
+    attempt: Callable[[ProviderSlot], Awaitable[tuple[Response | StreamingResponse | None, bool]]],
+    slots: Sequence[ProviderSlot],
+    delay: float,
+    logger: GatewayLogger,
+) -> tuple[Response | StreamingResponse | None, Response | None]:
+    """对冲转发：按顺序错峰请求各供应商，先成功的响应胜出
+
+    已发出的请求 delay 秒内都未返回时启动下一个供应商（对冲），
+    某个请求失败时也立即启动下一个（故障转移）。胜出后取消其余请求，
+    并等待它们结束，关闭其中落败的成功响应；已超过 delay 仍未返回而被取消的
+    请求按超时计入熔断。返回 (成功响应, 最后一个失败响应)。
+    """
+    remaining = iter(slots)
+    tasks: dict[asyncio.Task, tuple[ProviderSlot, int]] = {}
+    pending: set[asyncio.Task] = set()
+
+    def launch(hedge: bool) -> bool:
+        slot = next(remaining, None)
+        if slot is None:
+            return False
+        if hedge:
+            logger.info("hedge_attempt", provider=slot.provider.name)
+        task = asyncio.create_task(attempt(slot))
+        tasks[task] = (slot, time.monotonic_ns())
+        pending.add(task)
+        return True
+
+    launch(False)
+    exhausted = False
+    winner = last_resp = None
+    try:
+        while pending and winner is None:
+            done, _ = await asyncio.wait(
+                pending, timeout=None if exhausted else delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                exhausted = not launch(True)
+                continue
+            pending -= done
+            for task in done:
+                resp, ok = task.result()
+                if not ok:
+                    last_resp = resp or last_resp
+                    if winner is None and not exhausted:
+                        exhausted = not launch(False)
+                elif winner is None:
+                    winner = resp
+        return winner, None if winner else last_resp
+    finally:
+        # 取消落败的请求并等待全部结束：已完成或来不及取消的成功响应
+        # 必须关闭，否则其上游流和连接池中的连接不会被释放
+        now = time.monotonic_ns()
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for (slot, started), result in zip(tasks.values(), results):
+            if isinstance(result, asyncio.CancelledError):
+                # 超过对冲延迟仍未返回、被其他供应商抢先的请求视为超时，
+                # 否则一直挂起的供应商永远不会熔断，每个请求都要白等一次 delay
+                elapsed = (now - started) / 1_000_000
+                if winner is not None and elapsed >= delay * 1000:
+                    _handle_provider_failure(
+                        slot.breaker, slot.provider.name, slot.is_last, logger,
+                        "timeout", "cancelled after hedge delay", duration_ms=elapsed
+                    )
+            elif isinstance(result, tuple) and result[1] and result[0] is not winner:
+                if result[0].background:
+                    await result[0].background()
+
+
+async def _forward_request(
+    client: httpx.AsyncClient,
+    method: str,
+    target: str,
+    raw_headers: list[tuple[bytes, bytes]],
+    access_token: bytes,
     body: bytes,
     config: Config,
     breaker_mgr: CircuitBreakerManager,
-) -> Response:
-    """处理普通（非流式）请求"""
-    logger = get_logger()
-    providers = config.providers
+    logger: GatewayLogger,
+    is_stream: bool,
+) -> Response | StreamingResponse:
+    """按故障转移顺序转发请求
+
+    流式与普通请求走同一条路径，区别仅在于全部失败时：
+    普通请求返回最后一个 5xx 响应，流式请求返回 502。
+    """
+    routes = get_provider_routes(config, breaker_mgr)
     last_resp = None
 
-    async with httpx.AsyncClient() as client:
-        # 先尝试选择的供应商（可能是探测）
-        idx, provider, is_probe = select_provider(
-            providers, breaker_mgr, logger, config.circuit_breaker.probe_probability
+    if len(routes) == 1:
+        # 单供应商部署：唯一的供应商即保底，永不熔断，无需选择和排序（也不会对冲）
+        first, is_probe, order = routes[0], False, routes
+    else:
+        # 先尝试选择的供应商（可能是探测），再按顺序尝试其余可用的供应商
+        first, is_probe = select_provider(
+            routes, breaker_mgr, logger, config.circuit_breaker.probe_probability
         )
-        resp, ok = await _try_provider(client, request, headers, body, config,
-                                        provider, breaker_mgr, logger, is_probe)
-        if ok:
-            return resp
-        if resp:
-            last_resp = resp
+        order = build_attempt_order(routes, first)
 
-        # 如果是探测失败，继续正常流程
-        # 尝试剩余的供应商
-        for i, p in enumerate(providers):
-            if i == idx:  # 跳过已尝试的
-                continue
-
-            is_last = (i == len(providers) - 1)
-            breaker = breaker_mgr.get(p.name)
-
-            if not is_last and breaker.is_open():
-                continue
+    async def attempt(slot: ProviderSlot) -> tuple[Response | StreamingResponse | None, bool]:
+        return await _try_provider(
+            client, method, target, raw_headers, access_token, body, config,
+            slot, logger, is_probe and slot is first,
+        )
 
-            resp, ok = await _try_provider(client, request, headers, body, config,
-                                           p, breaker_mgr, logger, False)
+    # 非流式请求可对冲，流式响应无法在中途干净地取消，只能逐个尝试
+    if config.hedge_delay_ms and not is_stream and len(order) > 1:
+        resp, last_resp = await _hedged_attempt(attempt, order, config.hedge_delay_ms / 1000, logger)
+        if resp:
+            return resp
+    else:
+        for slot in order:
+            resp, ok = await attempt(slot)
             if ok:
                 return resp
             if resp:
                 last_resp = resp
 
-    if last_resp:
+    if last_resp and not is_stream:
         return last_resp
 
     logger.error("all_providers_failed", error="unavailable")
-    return Response(b'{"error":"Bad Gateway"}', 502, media_type="application/json")
-
-
-async def _stream_request(
-    request: Request,
-    headers: dict[str, str],
-    body: bytes,
-    config: Config,
-    breaker_mgr: CircuitBreakerManager,
-) -> Response | StreamingResponse:
-    """处理流式请求"""
-    logger = get_logger()
-    providers = config.providers
-
-    # 选择供应商
-    idx, provider, is_probe = select_provider(
-        providers, breaker_mgr, logger, config.circuit_breaker.probe_probability
-    )
-
-    # 构建尝试顺序：先选中的，再其他的
-    attempt_order = [(idx, provider, is_probe)]
-    for i, p in enumerate(providers):
-        if i != idx:
-            is_last = (i == len(providers) - 1)
-            breaker = breaker_mgr.get(p.name)
-            if is_last or not breaker.is_open():
-                attempt_order.append((i, p, False))
-
-    for idx, provider, is_probe in attempt_order:
-        breaker = breaker_mgr.get(provider.name)
-        is_last = (idx == len(providers) - 1)
-
-        start = time.time()
-        url = f"{provider.base_url}{request.url.path}"
-        if request.url.query:
-            url += f"?{request.url.query}"
-
-        req_headers = replace_token(filter_headers(headers), config.access_token, provider.token)
-        logger.request_forward(provider.name, url, attempt=1, probe=is_probe)
-
-        client = httpx.AsyncClient(timeout=config.timeout)
-        try:
-            resp = await client.send(
-                client.build_request(request.method, url, headers=req_headers, content=body),
-                stream=True
-            )
-            duration = (time.time() - start) * 1000
-
-            if resp.status_code >= 500:
-                content = await resp.aread()
-                await resp.aclose()
-                await client.aclose()
-
-                _handle_provider_failure(
-                    breaker, provider.name, is_last, logger,
-                    "http_error", content.decode(errors="replace")[:200],
-                    resp.status_code, duration
-                )
-                continue
-
-            breaker.record_success()
-            if is_probe:
-                logger.info("probe_success", provider=provider.name)
-            logger.request_success(provider.name, resp.status_code, duration)
-
-            async def stream():
-                try:
-                    async for chunk in resp.aiter_bytes():
-                        yield chunk
-                finally:
-                    await resp.aclose()
-                    await client.aclose()
-
-            return StreamingResponse(stream(), resp.status_code,
-                                   headers=filter_headers(dict(resp.headers)))
-
-        except httpx.RequestError as e:
-            duration = (time.time() - start) * 1000
-            await client.aclose()
-
-            _handle_provider_failure(
-                breaker, provider.name, is_last, logger,
-                _classify_error(e), str(e), duration_ms=duration
-            )
-
-    logger.error("all_providers_failed", error="unavailable")
-    return Response(b'{"error":"Bad Gateway"}', 502, media_type="application/json")
+    return _RESP_BAD_GATEWAY
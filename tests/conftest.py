@@ -1,4 +1,5 @@
 """Shared test fixtures for transparent-gateway tests."""
+import asyncio
 import logging
 import pytest
 import yaml
@@ -14,12 +15,21 @@ from transparent_gateway.config import (
 )
 from transparent_gateway.circuit_breaker import CircuitBreaker, CircuitBreakerManager
 from transparent_gateway.logging_config import GatewayLogger, reset_logger, set_logger
-from transparent_gateway.proxy import reset_breaker_manager, set_breaker_manager
+from transparent_gateway.proxy import reset_breaker_manager, reset_http_client, set_breaker_manager
 
 
-@pytest.fixture
+def pytest_asyncio_loop_factories(config, item):
+    """Run async tests on uvloop, like the server, where it is installed."""
+    try:
+        import uvloop
+    except ImportError:  # uvloop is not installed on Windows / non-CPython
+        return {"asyncio": asyncio.new_event_loop}
+    return {"uvloop": uvloop.new_event_loop}
+
+
+@pytest.fixture(scope="module")
 def sample_providers() -> list[Provider]:
-    """Sample provider list for testing."""
+    """Sample provider list for testing (shared per module, do not mutate)."""
     return [
         Provider(name="primary", base_url="https://api.primary.com", token="pk-primary"),
         Provider(name="backup", base_url="https://api.backup.com", token="pk-backup"),
@@ -37,7 +47,7 @@ def sample_config(sample_providers: list[Provider]) -> Config:
             reset_timeout=60,
             probe_probability=0.05,
         ),
-        providers=sample_providers,
+        providers=list(sample_providers),  # tests may add or drop providers
     )
 
 
@@ -84,8 +94,10 @@ def reset_globals():
     """Reset all global state before each test."""
     reset_config()
     reset_breaker_manager()
+    reset_http_client()
     reset_logger()
     yield
     reset_config()
     reset_breaker_manager()
+    reset_http_client()
     reset_logger()
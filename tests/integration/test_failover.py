@@ -1,11 +1,17 @@
 """Integration tests for failover logic."""
+import asyncio
+import gzip
+import os
 import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
 import httpx
 import respx
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import Headers
 
-from transparent_gateway.config import Config, set_config
+from transparent_gateway.config import Config, Provider, set_config
 from transparent_gateway.proxy import (
+    BUFFER_LIMIT,
     proxy_request,
     reset_breaker_manager,
     get_breaker_manager,
@@ -13,6 +19,14 @@ from transparent_gateway.proxy import (
 from transparent_gateway.circuit_breaker import CircuitBreakerManager
 
 
+class MockURL:
+    """Mock request URL with path and query."""
+
+    def __init__(self, path: str, query: str):
+        self.path = path
+        self.query = query
+
+
 class MockRequest:
     """Mock FastAPI Request object."""
 
@@ -25,19 +39,16 @@ class MockRequest:
         body: bytes = b'{"model": "test"}',
     ):
         self.method = method
-        self.headers = headers or {"Authorization": "Bearer test-token"}
+        self.headers = Headers(headers or {"authorization": "Bearer test-token"})
         self._body = body
-
-        class MockURL:
-            def __init__(self, path: str, query: str):
-                self.path = path
-                self.query = query
-
         self.url = MockURL(path, query)
 
     async def body(self) -> bytes:
         return self._body
 
+    async def stream(self):
+        yield self._body
+
 
 class TestFailover:
     """Tests for failover behavior."""
@@ -61,49 +72,65 @@ class TestFailover:
         assert response.status_code == 200
 
     @respx.mock
-    async def test_failover_on_5xx(self, sample_config: Config) -> None:
-        """5xx triggers failover to next provider."""
-        respx.post("https://api.primary.com/v1/messages").mock(
-            return_value=httpx.Response(500, content=b"Internal Server Error")
-        )
-        respx.post("https://api.backup.com/v1/messages").mock(
-            return_value=httpx.Response(200, json={"result": "ok"})
-        )
+    async def test_upstream_cookies_not_shared(self, sample_config: Config) -> None:
+        """Set-Cookie from one response is never sent on later upstream requests."""
+        route = respx.post("https://api.primary.com/v1/messages").mock(side_effect=[
+            httpx.Response(200, json={"result": "ok"},
+                           headers={"set-cookie": "session=userA-secret; Path=/"}),
+            httpx.Response(200, json={"result": "ok"}),
+        ])
 
-        request = MockRequest()
-        response = await proxy_request(request)
+        first = await proxy_request(MockRequest())
+        await proxy_request(MockRequest())
 
-        assert response.status_code == 200
+        assert first.headers["set-cookie"] == "session=userA-secret; Path=/"
+        assert "cookie" not in route.calls[1].request.headers
 
     @respx.mock
-    async def test_failover_on_connection_error(self, sample_config: Config) -> None:
-        """Connection error triggers failover."""
-        respx.post("https://api.primary.com/v1/messages").mock(
-            side_effect=httpx.ConnectError("Connection refused")
+    async def test_failover_resends_same_body_with_length(
+        self, sample_config: Config
+    ) -> None:
+        """Every attempt sends the same body bytes with Content-Length, not chunked."""
+        body = b'{"model": "test", "messages": []}'
+        primary = respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(500, content=b"Error")
         )
-        respx.post("https://api.backup.com/v1/messages").mock(
+        backup = respx.post("https://api.backup.com/v1/messages").mock(
             return_value=httpx.Response(200, json={"result": "ok"})
         )
 
-        request = MockRequest()
-        response = await proxy_request(request)
-
-        assert response.status_code == 200
-
+        await proxy_request(MockRequest(body=body))
+
+        for route in (primary, backup):
+            sent = route.calls.last.request
+            assert sent.content == body
+            assert sent.headers["content-length"] == str(len(body))
+            assert "transfer-encoding" not in sent.headers
+
+    @pytest.mark.parametrize("primary, body", [
+        pytest.param({"return_value": httpx.Response(500, content=b"Error")},
+                     b'{"model": "test"}', id="5xx"),
+        pytest.param({"side_effect": httpx.ConnectError("Connection refused")},
+                     b'{"model": "test"}', id="connect-error"),
+        pytest.param({"side_effect": httpx.TimeoutException("Request timed out")},
+                     b'{"model": "test"}', id="timeout"),
+        pytest.param({"return_value": httpx.Response(500, content=b"Error")},
+                     b'{"model": "test", "stream": true}', id="stream-5xx"),
+        pytest.param({"side_effect": httpx.ConnectError("Connection refused")},
+                     b'{"model": "test", "stream": true}', id="stream-connect-error"),
+    ])
     @respx.mock
-    async def test_failover_on_timeout(self, sample_config: Config) -> None:
-        """Timeout triggers failover."""
-        respx.post("https://api.primary.com/v1/messages").mock(
-            side_effect=httpx.TimeoutException("Request timed out")
-        )
+    async def test_failover(self, sample_config: Config, primary: dict, body: bytes) -> None:
+        """Primary 5xx, connection errors and timeouts fail over to the backup."""
+        respx.post("https://api.primary.com/v1/messages").mock(**primary)
         respx.post("https://api.backup.com/v1/messages").mock(
-            return_value=httpx.Response(200, json={"result": "ok"})
+            return_value=httpx.Response(200, content=b"ok")
         )
 
-        request = MockRequest()
-        response = await proxy_request(request)
+        response = await proxy_request(MockRequest(body=body))
 
         assert response.status_code == 200
+        assert response.body == b"ok"
 
     @respx.mock
     async def test_all_failed_returns_502(self, sample_config: Config) -> None:
@@ -153,6 +180,7 @@ class TestFailover:
         response = await proxy_request(request)
 
         assert response.status_code == 400
+        assert response.body == b'{"error":"Bad Request"}'
         assert primary_route.called
         assert not backup_route.called
 
@@ -166,90 +194,405 @@ class TestFailover:
             return_value=httpx.Response(200, json={"result": "ok"})
         )
 
-        # Make multiple requests to trip the circuit (threshold is 3)
-        for _ in range(3):
-            request = MockRequest()
-            await proxy_request(request)
-
-        # Check circuit is tripped
+        # Seed threshold - 1 failures directly; one real request lands the last
         mgr = get_breaker_manager()
-        assert mgr.get("primary").is_open()
+        breaker = mgr.get("primary")
+        for _ in range(sample_config.circuit_breaker.failure_threshold - 1):
+            breaker.record_failure()
+        assert not breaker.is_open()
+
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 200
+        assert breaker.is_open()
 
     @respx.mock
     async def test_success_resets_failure_count(self, sample_config: Config) -> None:
-        """Success resets the failure count."""
-        call_count = 0
+        """A success through the proxy resets the failure count."""
+        respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "ok"})
+        )
 
-        def primary_handler(request):
-            nonlocal call_count
-            call_count += 1
-            if call_count <= 2:
-                return httpx.Response(500, content=b"Error")
-            return httpx.Response(200, json={"result": "ok"})
+        breaker = get_breaker_manager().get("primary")
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.failure_count == 2
 
-        respx.post("https://api.primary.com/v1/messages").mock(side_effect=primary_handler)
-        respx.post("https://api.backup.com/v1/messages").mock(
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 200
+        assert breaker.failure_count == 0
+
+
+class TestSingleProvider:
+    """Tests for single-provider deployments."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, sample_config: Config):
+        del sample_config.providers[1:]
+        set_config(sample_config)
+        reset_breaker_manager()
+
+    @respx.mock
+    async def test_success(self, sample_config: Config) -> None:
+        """The only provider's response is returned."""
+        respx.post("https://api.primary.com/v1/messages").mock(
             return_value=httpx.Response(200, json={"result": "ok"})
         )
 
-        # Two failures
-        for _ in range(2):
-            request = MockRequest()
-            await proxy_request(request)
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 200
+        assert response.body == b'{"result":"ok"}'
+
+    @respx.mock
+    async def test_error_response_returned(self, sample_config: Config) -> None:
+        """A 5xx is returned as-is and never trips the breaker."""
+        respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(503, content=b"Unavailable")
+        )
+
+        for _ in range(sample_config.circuit_breaker.failure_threshold):
+            response = await proxy_request(MockRequest())
+
+        assert response.status_code == 503
+        assert not get_breaker_manager().get("primary").is_open()
+
+    @respx.mock
+    async def test_connection_error_returns_502(self, sample_config: Config) -> None:
+        """Connection errors return 502."""
+        respx.post("https://api.primary.com/v1/messages").mock(
+            side_effect=httpx.ConnectError("Connection refused")
+        )
+
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 502
+
+    @respx.mock
+    async def test_streaming_error_returns_502(self, sample_config: Config) -> None:
+        """A streaming request that gets a 5xx returns 502, as with several providers."""
+        respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(500, content=b"Error")
+        )
+
+        response = await proxy_request(MockRequest(body=b'{"model": "test", "stream": true}'))
+
+        assert response.status_code == 502
 
-        # Check failure count
-        mgr = get_breaker_manager()
-        assert mgr.get("primary").failure_count == 2
 
-        # Now primary succeeds (via probe or normal selection)
-        # Reset and try again with primary succeeding
+class TestBodyLimit:
+    """Tests for request body size limit."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, sample_config: Config):
+        sample_config.max_body_size = 16
+        set_config(sample_config)
         reset_breaker_manager()
-        call_count = 2  # Next call will succeed
 
-        request = MockRequest()
-        await proxy_request(request)
+    @respx.mock
+    async def test_oversized_body_rejected(self, sample_config: Config) -> None:
+        """Bodies above max_body_size get 413 and are never forwarded."""
+        route = respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "ok"})
+        )
 
-        mgr = get_breaker_manager()
-        assert mgr.get("primary").failure_count == 0
+        response = await proxy_request(MockRequest(body=b'{"model": "too-long-for-limit"}'))
 
+        assert response.status_code == 413
+        assert not route.called
 
-class TestStreamingFailover:
-    """Tests for streaming request failover."""
+    async def test_declared_length_rejected_early(self, sample_config: Config) -> None:
+        """A Content-Length above the limit is rejected without reading the body."""
+        request = MockRequest(headers={
+            "authorization": "Bearer test-token",
+            "content-length": "1000",
+        })
+        request.stream = None  # reading the body would fail
+
+        response = await proxy_request(request)
+
+        assert response.status_code == 413
+
+
+class TestHedging:
+    """Tests for hedged first attempts."""
 
     @pytest.fixture(autouse=True)
     def setup(self, sample_config: Config):
-        """Setup for each test."""
+        sample_config.hedge_delay_ms = 20
         set_config(sample_config)
         reset_breaker_manager()
 
+    @staticmethod
+    def slow(delay: float, status: int = 200):
+        async def handler(request):
+            await asyncio.sleep(delay)
+            return httpx.Response(status, json={"slow": True})
+        return handler
+
+    @respx.mock
+    async def test_slow_primary_is_hedged(self, sample_config: Config) -> None:
+        """A slow primary is raced against the backup and the first success wins."""
+        respx.post("https://api.primary.com/v1/messages").mock(side_effect=self.slow(2.0))
+        backup = respx.post("https://api.backup.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "ok"})
+        )
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 200
+        assert response.body == b'{"result":"ok"}'
+        assert backup.called
+        assert loop.time() - started < 1.0
+
     @respx.mock
-    async def test_streaming_failover_on_5xx(self, sample_config: Config) -> None:
-        """Streaming request fails over on 5xx."""
+    async def test_fast_primary_not_hedged(self, sample_config: Config) -> None:
+        """No backup request is sent when the primary answers within the delay."""
+        respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "ok"})
+        )
+        backup = respx.post("https://api.backup.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "ok"})
+        )
+
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 200
+        assert not backup.called
+
+    @respx.mock
+    async def test_hedge_fans_out_to_later_providers(self, sample_config: Config) -> None:
+        """Each elapsed delay starts the next provider until one succeeds."""
+        sample_config.providers.append(
+            Provider(name="third", base_url="https://api.third.com", token="pk-third")
+        )
+        respx.post("https://api.primary.com/v1/messages").mock(side_effect=self.slow(2.0))
+        respx.post("https://api.backup.com/v1/messages").mock(side_effect=self.slow(2.0))
+        third = respx.post("https://api.third.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "third"})
+        )
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        response = await proxy_request(MockRequest())
+
+        assert response.body == b'{"result":"third"}'
+        assert third.called
+        assert loop.time() - started < 1.0
+
+    @respx.mock
+    async def test_failure_starts_next_without_delay(self, sample_config: Config) -> None:
+        """A failed attempt starts the next provider immediately, not after the delay."""
+        sample_config.hedge_delay_ms = 5000
         respx.post("https://api.primary.com/v1/messages").mock(
             return_value=httpx.Response(500, content=b"Error")
         )
         respx.post("https://api.backup.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "ok"})
+        )
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 200
+        assert loop.time() - started < 1.0
+
+    @respx.mock
+    async def test_hedged_failures_fall_back_to_last_error(self, sample_config: Config) -> None:
+        """When both hedged attempts fail the last error response is returned."""
+        respx.post("https://api.primary.com/v1/messages").mock(
+            side_effect=self.slow(0.05, status=500)
+        )
+        respx.post("https://api.backup.com/v1/messages").mock(
+            side_effect=self.slow(0.1, status=503)
+        )
+
+        response = await proxy_request(MockRequest())
+
+        assert response.status_code == 503
+
+    @respx.mock
+    async def test_hung_primary_trips_breaker(self, sample_config: Config) -> None:
+        """A primary that never answers counts as a timeout each time the backup wins."""
+        respx.post("https://api.primary.com/v1/messages").mock(side_effect=self.slow(10.0))
+        respx.post("https://api.backup.com/v1/messages").mock(
+            return_value=httpx.Response(200, json={"result": "ok"})
+        )
+
+        for _ in range(sample_config.circuit_breaker.failure_threshold):
+            response = await proxy_request(MockRequest())
+            assert response.status_code == 200
+
+        assert get_breaker_manager().get("primary").is_open()
+
+    @respx.mock
+    async def test_simultaneous_successes_all_closed(self, sample_config: Config) -> None:
+        """When both hedged attempts succeed together the losing upstream response is closed too."""
+
+        class TrackedStream(httpx.AsyncByteStream):
+            def __init__(self) -> None:
+                self.closed = False
+
+            async def __aiter__(self):
+                yield b"data"
+
+            async def aclose(self) -> None:
+                self.closed = True
+
+        streams: list[TrackedStream] = []
+        released = asyncio.Event()
+
+        async def primary(request):
+            await released.wait()
+            streams.append(TrackedStream())
+            return httpx.Response(200, stream=streams[-1])
+
+        async def backup(request):
+            released.set()
+            streams.append(TrackedStream())
+            return httpx.Response(200, stream=streams[-1])
+
+        respx.post("https://api.primary.com/v1/messages").mock(side_effect=primary)
+        respx.post("https://api.backup.com/v1/messages").mock(side_effect=backup)
+
+        response = await proxy_request(MockRequest())
+        assert isinstance(response, StreamingResponse)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        await response.background()
+
+        assert body == b"data"
+        assert len(streams) == 2
+        assert all(stream.closed for stream in streams)
+
+    @respx.mock
+    async def test_streaming_not_hedged(self, sample_config: Config) -> None:
+        """Streaming requests are never hedged."""
+        respx.post("https://api.primary.com/v1/messages").mock(side_effect=self.slow(0.1))
+        backup = respx.post("https://api.backup.com/v1/messages").mock(
             return_value=httpx.Response(200, content=b"data: ok\n\n")
         )
 
+        response = await proxy_request(MockRequest(body=b'{"model": "test", "stream": true}'))
+
+        assert response.status_code == 200
+        assert not backup.called
+
+
+class TestStreamingFailover:
+    """Tests for streaming request failover."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, sample_config: Config):
+        """Setup for each test."""
+        set_config(sample_config)
+        reset_breaker_manager()
+
+    @respx.mock
+    async def test_streaming_passes_compressed_body_through(
+        self, sample_config: Config
+    ) -> None:
+        """Compressed upstream bytes are forwarded as-is with content-encoding."""
+        compressed = gzip.compress(b"data: ok\n\n")
+        respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(
+                200, content=compressed, headers={"content-encoding": "gzip"}
+            )
+        )
+
         request = MockRequest(body=b'{"model": "test", "stream": true}')
         response = await proxy_request(request)
 
         assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.body == compressed
 
     @respx.mock
-    async def test_streaming_failover_on_connection_error(
+    async def test_no_client_accept_encoding_requests_identity(
         self, sample_config: Config
     ) -> None:
-        """Streaming request fails over on connection error."""
+        """Without a client Accept-Encoding, upstream is asked for identity, not gzip."""
+        def handler(request):
+            if "gzip" in request.headers.get("accept-encoding", ""):
+                return httpx.Response(
+                    200, content=gzip.compress(b'{"result":"ok"}'),
+                    headers={"content-encoding": "gzip"},
+                )
+            return httpx.Response(200, content=b'{"result":"ok"}')
+
+        route = respx.post("https://api.primary.com/v1/messages").mock(side_effect=handler)
+
+        response = await proxy_request(MockRequest())
+
+        assert route.calls[0].request.headers["accept-encoding"] == "identity"
+        assert "content-encoding" not in response.headers
+        assert response.body == b'{"result":"ok"}'
+
+    @respx.mock
+    async def test_client_accept_encoding_forwarded(self, sample_config: Config) -> None:
+        """A client's own Accept-Encoding replaces the identity default."""
+        route = respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(200, content=b"ok")
+        )
+
+        await proxy_request(MockRequest(headers={
+            "authorization": "Bearer test-token", "accept-encoding": "gzip",
+        }))
+
+        assert route.calls[0].request.headers.get_list("accept-encoding") == ["gzip"]
+
+    @respx.mock
+    async def test_large_response_is_streamed(self, sample_config: Config) -> None:
+        """Responses above BUFFER_LIMIT are streamed raw instead of buffered."""
+        payload = gzip.compress(os.urandom(BUFFER_LIMIT * 2))
         respx.post("https://api.primary.com/v1/messages").mock(
-            side_effect=httpx.ConnectError("Connection refused")
+            return_value=httpx.Response(
+                200, content=payload, headers={"content-encoding": "gzip"}
+            )
+        )
+
+        response = await proxy_request(MockRequest())
+
+        assert isinstance(response, StreamingResponse)
+        assert response.headers["content-encoding"] == "gzip"
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        assert body == payload
+
+    @respx.mock
+    async def test_sse_content_type_passed_through(self, sample_config: Config) -> None:
+        """Upstream content-type is forwarded once, without a default media type."""
+        async def events():
+            yield b"event: ping\n\n"
+            yield b"data: ok\n\n"
+
+        respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(
+                200, content=events(), headers={"content-type": "text/event-stream"}
+            )
+        )
+
+        request = MockRequest(body=b'{"model": "test", "stream": true}')
+        response = await proxy_request(request)
+
+        assert isinstance(response, StreamingResponse)
+        assert response.headers.getlist("content-type") == ["text/event-stream"]
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        assert body == b"event: ping\n\ndata: ok\n\n"
+
+    @respx.mock
+    async def test_streaming_all_failed_returns_502(self, sample_config: Config) -> None:
+        """Streaming requests return 502 instead of the last 5xx response."""
+        respx.post("https://api.primary.com/v1/messages").mock(
+            return_value=httpx.Response(500, content=b"Error")
         )
         respx.post("https://api.backup.com/v1/messages").mock(
-            return_value=httpx.Response(200, content=b"data: ok\n\n")
+            return_value=httpx.Response(500, content=b"Error")
         )
 
         request = MockRequest(body=b'{"model": "test", "stream": true}')
         response = await proxy_request(request)
 
-        assert response.status_code == 200
+        assert response.status_code == 502
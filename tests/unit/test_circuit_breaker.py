@@ -1,11 +1,23 @@
 """Tests for circuit_breaker.py module."""
 import time
 import pytest
-from unittest.mock import Mock
 
 from transparent_gateway.circuit_breaker import CircuitBreaker, CircuitBreakerManager
 
 
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
 class TestCircuitBreaker:
     """Tests for CircuitBreaker class."""
 
@@ -15,26 +27,22 @@ class TestCircuitBreaker:
         assert not breaker.is_open()
         assert breaker.failure_count == 0
 
-    def test_trips_after_threshold(self) -> None:
-        """Breaker opens after N failures."""
-        breaker = CircuitBreaker(timeout=60, failure_threshold=3)
-        breaker.record_failure()
-        breaker.record_failure()
-        assert not breaker.is_open()
-        breaker.record_failure()
-        assert breaker.is_open()
-
-    def test_success_resets_count(self) -> None:
-        """Success resets failure count."""
-        breaker = CircuitBreaker(timeout=60, failure_threshold=3)
-        breaker.record_failure()
-        breaker.record_failure()
-        breaker.record_success()
-        assert breaker.failure_count == 0
-        assert not breaker.is_open()
+    def test_threshold_lattice(self) -> None:
+        """Breaker opens exactly at the threshold, counts every failure, and success resets it."""
+        for threshold in range(1, 11):
+            for failures in range(21):
+                case = (threshold, failures)
+                breaker = CircuitBreaker(timeout=60, failure_threshold=threshold)
+                for _ in range(failures):
+                    breaker.record_failure()
+                assert breaker.failure_count == failures, case
+                assert breaker.is_open() == (failures >= threshold), case
+                breaker.record_success()
+                assert breaker.failure_count == 0, case
+                assert not breaker.is_open(), case
 
     def test_auto_reset_after_timeout(self) -> None:
-        """Breaker auto-resets after timeout."""
+        """Breaker auto-resets after timeout on the real monotonic clock."""
         breaker = CircuitBreaker(timeout=1, failure_threshold=1)
         breaker.record_failure()
         assert breaker.is_open()
@@ -43,18 +51,20 @@ class TestCircuitBreaker:
 
     def test_auto_reset_callback(self) -> None:
         """Auto-reset triggers callback."""
-        callback = Mock()
+        calls: list[str] = []
+        clock = FakeClock()
         breaker = CircuitBreaker(
             timeout=1,
             failure_threshold=1,
-            on_auto_reset=callback,
+            on_auto_reset=calls.append,
             name="test-provider",
+            clock=clock,
         )
         breaker.record_failure()
         assert breaker.is_open()
-        time.sleep(1.1)
+        clock.advance(1.1)
         assert not breaker.is_open()
-        callback.assert_called_once_with("test-provider")
+        assert calls == ["test-provider"]
 
     def test_remaining_time(self) -> None:
         """remaining_time returns correct value."""
@@ -67,14 +77,12 @@ class TestCircuitBreaker:
 
     def test_remaining_time_decreases(self) -> None:
         """remaining_time decreases over time."""
-        breaker = CircuitBreaker(timeout=60, failure_threshold=1)
+        clock = FakeClock()
+        breaker = CircuitBreaker(timeout=60, failure_threshold=1, clock=clock)
         breaker.record_failure()
-        remaining1 = breaker.remaining_time()
-        time.sleep(0.1)
-        remaining2 = breaker.remaining_time()
-        assert remaining2 is not None
-        assert remaining1 is not None
-        assert remaining2 < remaining1
+        assert breaker.remaining_time() == 60
+        clock.advance(0.5)
+        assert breaker.remaining_time() == 59.5
 
     def test_manual_reset(self) -> None:
         """reset() clears state."""
@@ -92,14 +100,50 @@ class TestCircuitBreaker:
         breaker.trip()
         assert breaker.is_open()
 
-    def test_failure_count_property(self) -> None:
-        """failure_count returns current count."""
-        breaker = CircuitBreaker(timeout=60, failure_threshold=5)
-        assert breaker.failure_count == 0
+    def test_record_failure_reports_trip(self) -> None:
+        """record_failure() returns True only on the tripping failure."""
+        breaker = CircuitBreaker(timeout=60, failure_threshold=2)
+        assert breaker.record_failure() is False
+        assert breaker.record_failure() is True
+        assert breaker.record_failure() is False
+        assert breaker.state == "open"
+
+    def test_half_open_after_timeout(self) -> None:
+        """Breaker turns half-open after timeout and only lets probes through."""
+        breaker = CircuitBreaker(timeout=0, failure_threshold=1, probe_probability=0.0)
         breaker.record_failure()
-        assert breaker.failure_count == 1
+        assert breaker.is_open()
+        assert breaker.state == "half_open"
+        assert breaker.remaining_time() == 0
+
+    def test_half_open_probe_allowed(self) -> None:
+        """Half-open breaker lets a probe through by probability."""
+        breaker = CircuitBreaker(timeout=0, failure_threshold=1, probe_probability=1.0)
         breaker.record_failure()
-        assert breaker.failure_count == 2
+        assert not breaker.is_open()
+        assert breaker.state == "half_open"
+
+    def test_half_open_success_closes(self) -> None:
+        """Success while half-open closes the breaker."""
+        breaker = CircuitBreaker(timeout=0, failure_threshold=3, probe_probability=0.0)
+        breaker.trip()
+        assert breaker.state == "half_open"
+        assert breaker.record_success() is True
+        assert breaker.state == "closed"
+        assert not breaker.is_open()
+        assert breaker.record_success() is False
+
+    def test_half_open_failure_reopens(self) -> None:
+        """A single failure while half-open re-opens the breaker."""
+        breaker = CircuitBreaker(timeout=0, failure_threshold=3, probe_probability=0.0)
+        breaker.trip()
+        assert breaker.state == "half_open"
+        breaker.timeout = 60
+        assert breaker.record_failure() is True
+        assert breaker.state == "open"
+        remaining = breaker.remaining_time()
+        assert remaining is not None
+        assert 59 < remaining <= 60
 
 
 class TestCircuitBreakerManager:
@@ -125,32 +169,35 @@ class TestCircuitBreakerManager:
         b2 = mgr.get("provider2")
         assert b1 is not b2
 
-    def test_status_returns_all(self) -> None:
-        """status() returns all breaker states."""
-        mgr = CircuitBreakerManager(timeout=60, failure_threshold=1)
-        mgr.get("p1").record_failure()
-        mgr.get("p2")
-        status = mgr.status()
-        assert "p1" in status
-        assert "p2" in status
-        assert status["p1"]["is_open"] is True
-        assert status["p2"]["is_open"] is False
-
-    def test_status_includes_failure_count(self) -> None:
-        """status() includes failure_count."""
-        mgr = CircuitBreakerManager(timeout=60, failure_threshold=5)
+    @pytest.fixture(scope="class")
+    @classmethod
+    def status(cls) -> dict[str, dict]:
+        """status() of a manager with one open, one failing and one idle breaker."""
+        mgr = CircuitBreakerManager(timeout=60, failure_threshold=2, clock=FakeClock())
         mgr.get("p1").record_failure()
         mgr.get("p1").record_failure()
-        status = mgr.status()
-        assert status["p1"]["failure_count"] == 2
+        mgr.get("p2").record_failure()
+        mgr.get("p3")
+        return mgr.status()
 
-    def test_status_includes_remaining_time(self) -> None:
-        """status() includes remaining_time."""
-        mgr = CircuitBreakerManager(timeout=60, failure_threshold=1)
-        mgr.get("p1").record_failure()
-        status = mgr.status()
-        assert status["p1"]["remaining_time"] is not None
-        assert status["p1"]["remaining_time"] > 0
+    def test_status_returns_all(self, status: dict[str, dict]) -> None:
+        """status() returns every breaker."""
+        assert set(status) == {"p1", "p2", "p3"}
+
+    @pytest.mark.parametrize("name, field, expected", [
+        ("p1", "state", "open"),
+        ("p1", "is_open", True),
+        ("p1", "failure_count", 2),
+        ("p1", "remaining_time", 60),
+        ("p2", "state", "closed"),
+        ("p2", "is_open", False),
+        ("p2", "failure_count", 1),
+        ("p2", "remaining_time", None),
+        ("p3", "failure_count", 0),
+    ])
+    def test_status_fields(self, status: dict[str, dict], name: str, field: str, expected) -> None:
+        """status() reports state, failure count and remaining time per breaker."""
+        assert status[name][field] == expected
 
     def test_reset_all(self) -> None:
         """reset_all() resets all breakers."""
@@ -165,17 +212,19 @@ class TestCircuitBreakerManager:
 
     def test_on_auto_reset_callback(self) -> None:
         """Manager passes on_auto_reset to breakers."""
-        callback = Mock()
+        calls: list[str] = []
+        clock = FakeClock()
         mgr = CircuitBreakerManager(
             timeout=1,
             failure_threshold=1,
-            on_auto_reset=callback,
+            on_auto_reset=calls.append,
+            clock=clock,
         )
         mgr.get("provider1").record_failure()
         assert mgr.get("provider1").is_open()
-        time.sleep(1.1)
+        clock.advance(1.1)
         assert not mgr.get("provider1").is_open()
-        callback.assert_called_once_with("provider1")
+        assert calls == ["provider1"]
 
     def test_breaker_inherits_config(self) -> None:
         """Breakers inherit timeout and threshold from manager."""
@@ -183,3 +232,30 @@ class TestCircuitBreakerManager:
         breaker = mgr.get("test")
         assert breaker.timeout == 120
         assert breaker.failure_threshold == 10
+
+    def test_provider_names_preseeded(self) -> None:
+        """provider_names creates breakers up front."""
+        mgr = CircuitBreakerManager(timeout=60, failure_threshold=3, provider_names=["p1", "p2"])
+        assert set(mgr.status()) == {"p1", "p2"}
+        assert mgr.get("p1") is mgr.get("p1")
+
+    def test_open_count_tracks_transitions(self) -> None:
+        """open_count follows open, half-open and close transitions."""
+        mgr = CircuitBreakerManager(timeout=60, failure_threshold=2, provider_names=["p1", "p2"])
+        assert mgr.open_count == 0
+        mgr.get("p1").record_failure()
+        assert mgr.open_count == 0
+        mgr.get("p1").record_failure()
+        mgr.get("p2").trip()
+        assert mgr.open_count == 2
+        mgr.get("p1").record_success()
+        assert mgr.open_count == 1
+        mgr.reset_all()
+        assert mgr.open_count == 0
+
+    def test_open_count_includes_half_open(self) -> None:
+        """Half-open breakers still count until a probe succeeds."""
+        mgr = CircuitBreakerManager(timeout=0, failure_threshold=1)
+        mgr.get("p1").record_failure()
+        assert mgr.get("p1").state == "half_open"
+        assert mgr.open_count == 1
@@ -8,7 +8,9 @@ from transparent_gateway.config import (
     Provider,
     CircuitBreakerConfig,
     load_config,
+    load_config_from_string,
     get_config,
+    init_config,
     set_config,
 )
 
@@ -30,45 +32,44 @@ class TestLoadConfig:
         with pytest.raises(FileNotFoundError):
             load_config("/nonexistent/config.yaml")
 
-    def test_load_empty_providers(self, tmp_path: Path) -> None:
+    def test_load_empty_providers(self) -> None:
         """Config with no providers raises ValueError."""
-        config_path = tmp_path / "config.yaml"
-        config_path.write_text("gateway:\n  timeout: 60\nproviders: []")
         with pytest.raises(ValueError, match="At least one provider"):
-            load_config(str(config_path))
+            load_config_from_string("gateway:\n  timeout: 60\nproviders: []")
 
-    def test_default_values(self, tmp_path: Path) -> None:
+    def test_default_values(self) -> None:
         """Missing fields use defaults."""
-        config_path = tmp_path / "config.yaml"
-        config_path.write_text("""
+        config = load_config_from_string("""
 providers:
   - name: test
     base_url: https://test.com
     token: tk
 """)
-        config = load_config(str(config_path))
         assert config.timeout == 60.0
         assert config.access_token == ""
         assert config.circuit_breaker.failure_threshold == 5
         assert config.circuit_breaker.reset_timeout == 600
         assert config.circuit_breaker.probe_probability == 0.05
-
-    def test_base_url_trailing_slash_stripped(self, tmp_path: Path) -> None:
+        assert config.http.http2 is True
+        assert config.http.max_connections == 500
+        assert config.http.max_keepalive_connections == 100
+        assert config.http.keepalive_expiry == 30.0
+        assert config.max_body_size == 32 * 1024 * 1024
+        assert config.hedge_delay_ms == 0
+
+    def test_base_url_trailing_slash_stripped(self) -> None:
         """Base URLs have trailing slashes removed."""
-        config_path = tmp_path / "config.yaml"
-        config_path.write_text("""
+        config = load_config_from_string("""
 providers:
   - name: test
     base_url: https://test.com/
     token: tk
 """)
-        config = load_config(str(config_path))
         assert config.providers[0].base_url == "https://test.com"
 
-    def test_circuit_breaker_config(self, tmp_path: Path) -> None:
+    def test_circuit_breaker_config(self) -> None:
         """Circuit breaker config loads correctly."""
-        config_path = tmp_path / "config.yaml"
-        config_path.write_text("""
+        config = load_config_from_string("""
 gateway:
   circuit_breaker:
     failure_threshold: 10
@@ -79,11 +80,29 @@ providers:
     base_url: https://test.com
     token: tk
 """)
-        config = load_config(str(config_path))
         assert config.circuit_breaker.failure_threshold == 10
         assert config.circuit_breaker.reset_timeout == 300
         assert config.circuit_breaker.probe_probability == 0.1
 
+    def test_http_config(self) -> None:
+        """Upstream HTTP client config loads correctly."""
+        config = load_config_from_string("""
+gateway:
+  http:
+    http2: false
+    max_connections: 50
+    max_keepalive_connections: 10
+    keepalive_expiry: 5
+providers:
+  - name: test
+    base_url: https://test.com
+    token: tk
+""")
+        assert config.http.http2 is False
+        assert config.http.max_connections == 50
+        assert config.http.max_keepalive_connections == 10
+        assert config.http.keepalive_expiry == 5
+
 
 class TestGetConfig:
     """Tests for get_config function."""
@@ -95,6 +114,12 @@ class TestGetConfig:
         config2 = get_config()
         assert config1 is config2
 
+    def test_init_config_sets_global(self, config_file: Path) -> None:
+        """init_config loads the file and installs it globally."""
+        config = init_config(str(config_file))
+        assert get_config() is config
+        assert config.providers[0].name == "primary"
+
     def test_set_config_overrides(self, sample_config: Config) -> None:
         """set_config can override the global config."""
         set_config(sample_config)
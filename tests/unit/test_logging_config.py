@@ -0,0 +1,138 @@
+"""Tests for logging_config.py module."""
+import json
+import logging
+from unittest.mock import Mock
+
+from transparent_gateway.logging_config import (
+    GatewayLogger,
+    StructuredFormatter,
+    generate_request_id,
+    request_id_var,
+)
+
+
+def make_record(msg: str = "event", **fields) -> logging.LogRecord:
+    record = logging.LogRecord("transparent_gateway", logging.INFO, __file__, 1, msg, None, None)
+    if fields:
+        record.extra_fields = fields
+    return record
+
+
+class TestStructuredFormatter:
+    """Tests for StructuredFormatter class."""
+
+    def test_outputs_json(self) -> None:
+        """Formatted record is a JSON object with the base fields."""
+        data = json.loads(StructuredFormatter().format(make_record("hello")))
+        assert data["level"] == "INFO"
+        assert data["logger"] == "transparent_gateway"
+        assert data["msg"] == "hello"
+
+    def test_timestamp_utc_z_suffix(self) -> None:
+        """Timestamp is ISO 8601 UTC with a Z suffix."""
+        data = json.loads(StructuredFormatter().format(make_record()))
+        assert data["ts"].endswith("Z")
+        assert "T" in data["ts"]
+
+    def test_timestamp_millisecond_precision(self) -> None:
+        """Timestamp is derived from the record time at millisecond precision."""
+        record = make_record()
+        record.created = 1767225600.123456  # 2026-01-01T00:00:00.123456Z
+        data = json.loads(StructuredFormatter().format(record))
+        assert data["ts"] == "2026-01-01T00:00:00.123Z"
+
+    def test_timestamp_cache_refreshes(self) -> None:
+        """Records in a later millisecond get a new timestamp."""
+        formatter = StructuredFormatter()
+        first, second = make_record(), make_record()
+        first.created = 1767225600.1231
+        second.created = 1767225600.1239
+        third = make_record()
+        third.created = 1767225601.5
+        assert json.loads(formatter.format(first))["ts"] == "2026-01-01T00:00:00.123Z"
+        assert json.loads(formatter.format(second))["ts"] == "2026-01-01T00:00:00.123Z"
+        assert json.loads(formatter.format(third))["ts"] == "2026-01-01T00:00:01.500Z"
+
+    def test_extra_fields_merged(self) -> None:
+        """extra_fields are merged into the top-level object."""
+        data = json.loads(StructuredFormatter().format(make_record(provider="p1", status=200)))
+        assert data["provider"] == "p1"
+        assert data["status"] == 200
+
+    def test_non_ascii_preserved(self) -> None:
+        """Non-ASCII text is written as-is, not escaped."""
+        output = StructuredFormatter().format(make_record(model="模型"))
+        assert "模型" in output
+
+    def test_request_id_included(self) -> None:
+        """Current request ID is added when set."""
+        token = request_id_var.set("abc12345")
+        try:
+            data = json.loads(StructuredFormatter().format(make_record()))
+        finally:
+            request_id_var.reset(token)
+        assert data["req_id"] == "abc12345"
+
+
+class TestGatewayLogger:
+    """Tests for GatewayLogger class."""
+
+    @staticmethod
+    def make_logger(level: int) -> tuple[GatewayLogger, Mock]:
+        logger = logging.getLogger(f"test_gateway_level_{level}")
+        logger.handlers.clear()
+        logger.propagate = False
+        logger.setLevel(level)
+        handler = Mock(spec=logging.Handler)
+        handler.level = logging.NOTSET
+        logger.addHandler(handler)
+        return GatewayLogger(logger), handler
+
+    def test_enabled_level_emits(self) -> None:
+        """Records at an enabled level reach the handler with extra fields."""
+        gw, handler = self.make_logger(logging.INFO)
+        gw.request_success("p1", 200, 12.345, "HTTP/2")
+        record = handler.handle.call_args.args[0]
+        assert record.getMessage() == "request_success"
+        assert record.extra_fields == {
+            "provider": "p1", "status": 200, "duration_ms": 12.35, "http_version": "HTTP/2",
+        }
+
+    def test_disabled_level_skipped(self) -> None:
+        """Records below the logger level never reach the handler."""
+        gw, handler = self.make_logger(logging.WARNING)
+        gw.debug("noise", a=1)
+        gw.info("noise")
+        gw.request_start("POST", "/v1/messages")
+        gw.request_success("p1", 200, 1.0)
+        handler.handle.assert_not_called()
+
+    def test_failure_bytes_truncated_on_emit(self) -> None:
+        """Byte error bodies are truncated to 200 bytes and decoded when logged."""
+        gw, handler = self.make_logger(logging.INFO)
+        gw.request_failure("p1", "http_error", b"\xff" + b"x" * 1000, 502)
+        record = handler.handle.call_args.args[0]
+        assert record.extra_fields["error_msg"] == "\ufffd" + "x" * 199
+        assert record.extra_fields["status"] == 502
+
+    def test_no_fields_no_extra(self) -> None:
+        """Records without fields carry no extra_fields attribute."""
+        gw, handler = self.make_logger(logging.INFO)
+        gw.info("plain")
+        record = handler.handle.call_args.args[0]
+        assert not hasattr(record, "extra_fields")
+
+
+class TestGenerateRequestId:
+    """Tests for generate_request_id function."""
+
+    def test_eight_hex_chars(self) -> None:
+        """Request IDs are 8 lowercase hex characters."""
+        rid = generate_request_id()
+        assert len(rid) == 8
+        int(rid, 16)
+        assert rid == rid.lower()
+
+    def test_ids_differ(self) -> None:
+        """Consecutive request IDs are distinct."""
+        assert len({generate_request_id() for _ in range(100)}) == 100
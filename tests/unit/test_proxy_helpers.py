@@ -1,19 +1,25 @@
 """Tests for proxy.py helper functions."""
 import pytest
-from unittest.mock import patch, Mock
 
-from transparent_gateway.config import Provider
+from transparent_gateway.config import Config, Provider
 from transparent_gateway.circuit_breaker import CircuitBreakerManager
 from transparent_gateway.logging_config import GatewayLogger
 from transparent_gateway.proxy import (
+    RAW_RESPONSE_HOP_BY_HOP,
     filter_headers,
     replace_token,
+    build_forward_headers,
     check_auth,
+    is_json_content_type,
     parse_body,
     select_provider,
+    build_provider_slots,
+    build_attempt_order,
+    get_provider_routes,
     _classify_error,
 )
 import httpx
+from starlette.datastructures import Headers
 
 
 class TestFilterHeaders:
@@ -21,41 +27,48 @@ class TestFilterHeaders:
 
     def test_removes_hop_by_hop(self) -> None:
         """Hop-by-hop headers are removed."""
-        headers = {
+        headers = httpx.Headers({
             "Content-Type": "application/json",
             "Connection": "keep-alive",
             "Host": "example.com",
             "Authorization": "Bearer token",
-        }
-        filtered = filter_headers(headers)
-        assert "Content-Type" in filtered
-        assert "Authorization" in filtered
-        assert "Connection" not in filtered
-        assert "Host" not in filtered
+        })
+        filtered = dict(filter_headers(headers))
+        assert b"content-type" in filtered
+        assert b"authorization" in filtered
+        assert b"connection" not in filtered
+        assert b"host" not in filtered
 
     def test_case_insensitive(self) -> None:
-        """Header filtering is case-insensitive."""
-        headers = {"CONTENT-LENGTH": "100", "X-Custom": "value"}
+        """Header filtering is case-insensitive and keys come out lowercase."""
+        headers = httpx.Headers({"CONTENT-LENGTH": "100", "X-Custom": "value"})
+        assert filter_headers(headers) == [(b"x-custom", b"value")]
+
+    def test_lowercase_keys_reused(self) -> None:
+        """Already-lowercase keys (HTTP/2) are passed through as the same objects."""
+        headers = httpx.Headers([(b"x-request-id", b"1"), (b"connection", b"close")])
         filtered = filter_headers(headers)
-        assert "CONTENT-LENGTH" not in filtered
-        assert "X-Custom" in filtered
+        assert filtered == [(b"x-request-id", b"1")]
+        assert filtered[0][0] is headers.raw[0][0]
 
     def test_removes_content_encoding(self) -> None:
         """content-encoding header is removed."""
-        headers = {"Content-Encoding": "gzip", "Accept": "application/json"}
-        filtered = filter_headers(headers)
-        assert "Content-Encoding" not in filtered
-        assert "Accept" in filtered
+        headers = httpx.Headers({"Content-Encoding": "gzip", "Accept": "application/json"})
+        assert filter_headers(headers) == [(b"accept", b"application/json")]
+
+    def test_keeps_content_encoding_for_raw_passthrough(self) -> None:
+        """RAW_RESPONSE_HOP_BY_HOP keeps content-encoding."""
+        headers = httpx.Headers({"Content-Encoding": "gzip", "Content-Length": "3"})
+        assert filter_headers(headers, RAW_RESPONSE_HOP_BY_HOP) == [(b"content-encoding", b"gzip")]
 
     def test_empty_headers(self) -> None:
-        """Empty headers returns empty dict."""
-        assert filter_headers({}) == {}
+        """Empty headers returns empty list."""
+        assert filter_headers(httpx.Headers()) == []
 
-    def test_preserves_custom_headers(self) -> None:
-        """Custom headers are preserved."""
-        headers = {"X-Custom-Header": "value", "X-Request-Id": "123"}
-        filtered = filter_headers(headers)
-        assert filtered == headers
+    def test_preserves_duplicate_headers(self) -> None:
+        """Repeated headers such as Set-Cookie are kept individually."""
+        headers = httpx.Headers([("Set-Cookie", "a=1"), ("Set-Cookie", "b=2")])
+        assert filter_headers(headers) == [(b"set-cookie", b"a=1"), (b"set-cookie", b"b=2")]
 
 
 class TestReplaceToken:
@@ -81,16 +94,55 @@ class TestReplaceToken:
 
     def test_replaces_multiple_occurrences(self) -> None:
         """Multiple occurrences in same value are replaced."""
-        headers = {"X-Auth": "token-token-end"}
+        headers = {"Authorization": "token-token-end"}
         result = replace_token(headers, "token", "new")
-        assert result["X-Auth"] == "new-new-end"
+        assert result["Authorization"] == "new-new-end"
 
     def test_replaces_in_multiple_headers(self) -> None:
-        """Token in multiple headers is replaced."""
-        headers = {"Authorization": "Bearer tk", "X-Token": "tk"}
+        """Token in both auth headers is replaced."""
+        headers = {"Authorization": "Bearer tk", "X-Api-Key": "tk"}
         result = replace_token(headers, "tk", "new-tk")
         assert result["Authorization"] == "Bearer new-tk"
-        assert result["X-Token"] == "new-tk"
+        assert result["X-Api-Key"] == "new-tk"
+
+    def test_ignores_non_auth_headers(self) -> None:
+        """Token in other headers is left untouched."""
+        headers = {"authorization": "Bearer tk", "x-token": "tk"}
+        result = replace_token(headers, "tk", "new")
+        assert result["authorization"] == "Bearer new"
+        assert result["x-token"] == "tk"
+
+
+class TestBuildForwardHeaders:
+    """Tests for build_forward_headers function."""
+
+    def test_filters_and_replaces(self) -> None:
+        """Hop-by-hop headers are dropped and the token is replaced."""
+        raw = Headers({
+            "Authorization": "Bearer gw-token",
+            "Host": "gateway.local",
+            "Content-Length": "10",
+            "X-Custom": "value",
+        }).raw
+        result = build_forward_headers(raw, b"gw-token", b"pk-provider")
+        assert result == [(b"authorization", b"Bearer pk-provider"), (b"x-custom", b"value")]
+
+    def test_empty_access_token_only_filters(self) -> None:
+        """Empty access token leaves values untouched."""
+        raw = [(b"authorization", b"Bearer something"), (b"connection", b"close")]
+        result = build_forward_headers(raw, b"", b"pk-provider")
+        assert result == [(b"authorization", b"Bearer something")]
+
+    def test_only_auth_headers_replaced(self) -> None:
+        """Token in non-auth headers is left untouched."""
+        raw = [(b"x-api-key", b"tk"), (b"x-auth", b"tk"), (b"te", b"trailers")]
+        result = build_forward_headers(raw, b"tk", b"new")
+        assert result == [(b"x-api-key", b"new"), (b"x-auth", b"tk")]
+
+    def test_duplicate_headers_preserved(self) -> None:
+        """Repeated header lines are forwarded individually."""
+        raw = [(b"accept", b"a"), (b"accept", b"b")]
+        assert build_forward_headers(raw, b"tk", b"new") == raw
 
 
 class TestCheckAuth:
@@ -98,28 +150,64 @@ class TestCheckAuth:
 
     def test_empty_token_always_passes(self) -> None:
         """Empty required token always passes."""
-        assert check_auth({"Authorization": "anything"}, "") is True
-        assert check_auth({}, "") is True
+        assert check_auth(Headers({"authorization": "anything"}).raw, b"") is True
+        assert check_auth(Headers({}).raw, b"") is True
 
     def test_token_in_authorization_header(self) -> None:
         """Token found in Authorization header passes."""
-        assert check_auth({"Authorization": "Bearer secret"}, "secret") is True
+        assert check_auth(Headers({"authorization": "Bearer secret"}).raw, b"secret") is True
+
+    def test_token_in_x_api_key_header(self) -> None:
+        """Token found in X-API-Key header passes."""
+        assert check_auth(Headers({"x-api-key": "secret"}).raw, b"secret") is True
 
-    def test_token_in_any_header(self) -> None:
-        """Token found in any header value passes."""
-        assert check_auth({"X-Custom": "Bearer secret"}, "secret") is True
+    def test_token_in_other_header_fails(self) -> None:
+        """Token in any other header is not accepted."""
+        assert check_auth(Headers({"x-custom": "Bearer secret"}).raw, b"secret") is False
 
     def test_token_not_found_fails(self) -> None:
         """Missing token fails."""
-        assert check_auth({"Authorization": "Bearer other"}, "secret") is False
+        assert check_auth(Headers({"authorization": "Bearer other"}).raw, b"secret") is False
 
     def test_empty_headers_fails(self) -> None:
         """Empty headers with required token fails."""
-        assert check_auth({}, "secret") is False
+        assert check_auth(Headers({}).raw, b"secret") is False
+
+    def test_duplicate_auth_headers(self) -> None:
+        """Any auth header line carrying the exact token passes."""
+        raw = [(b"x-api-key", b"wrong"), (b"x-api-key", b"secret")]
+        assert check_auth(raw, b"secret") is True
+
+    def test_partial_match_fails(self) -> None:
+        """Token must match exactly, not as a substring."""
+        assert check_auth(Headers({"x-api-key": "prefix-secret-suffix"}).raw, b"secret") is False
+        assert check_auth(Headers({"authorization": "Bearer secret-suffix"}).raw, b"secret") is False
+
+    def test_bearer_scheme_case_insensitive(self) -> None:
+        """Bearer scheme is matched case-insensitively."""
+        assert check_auth(Headers({"authorization": "bearer secret"}).raw, b"secret") is True
+
+    def test_raw_authorization_value_passes(self) -> None:
+        """Authorization without a scheme is compared as-is."""
+        assert check_auth(Headers({"authorization": "secret"}).raw, b"secret") is True
+
+
+class TestIsJsonContentType:
+    """Tests for is_json_content_type function."""
 
-    def test_partial_match_passes(self) -> None:
-        """Partial token match in value passes."""
-        assert check_auth({"X-Auth": "prefix-secret-suffix"}, "secret") is True
+    def test_json_types(self) -> None:
+        """application/json and +json variants are JSON."""
+        assert is_json_content_type(Headers({"content-type": "application/json"}).raw) is True
+        assert is_json_content_type(Headers({"content-type": "application/vnd.api+JSON"}).raw) is True
+
+    def test_missing_header_assumed_json(self) -> None:
+        """Requests without content-type are still scanned."""
+        assert is_json_content_type(Headers({"x-api-key": "k"}).raw) is True
+
+    def test_non_json_types(self) -> None:
+        """Multipart and binary bodies are not JSON."""
+        assert is_json_content_type(Headers({"content-type": "multipart/form-data; boundary=x"}).raw) is False
+        assert is_json_content_type(Headers({"content-type": "application/octet-stream"}).raw) is False
 
 
 class TestParseBody:
@@ -175,12 +263,41 @@ class TestParseBody:
         assert model is None
         assert stream is True
 
+    def test_whitespace_variants(self) -> None:
+        """Whitespace around the colon is tolerated."""
+        body = b'{\n  "model" :  "gpt-4",\n  "stream"\t:\ttrue\n}'
+        assert parse_body(body) == ("gpt-4", True)
+
+    def test_stream_string_not_true(self) -> None:
+        """A string "true" is not a boolean stream flag."""
+        _, stream = parse_body(b'{"stream": "true"}')
+        assert stream is False
+
+    def test_escaped_key_in_content_ignored(self) -> None:
+        """Escaped quotes inside string values do not match."""
+        body = b'{"model": "m", "prompt": "{\\"stream\\": true}"}'
+        assert parse_body(body) == ("m", False)
+
+    def test_escaped_model_decoded(self) -> None:
+        """Escape sequences in the model value are decoded."""
+        body = b'{"model": "a\\"b\\u00e9", "stream": true}'
+        assert parse_body(body) == ('a"b\u00e9', True)
+
     def test_unicode_body(self) -> None:
         """Unicode in body is handled."""
         body = '{"model": "模型"}'.encode("utf-8")
         model, _ = parse_body(body)
         assert model == "模型"
 
+    def test_non_object_body_skipped(self) -> None:
+        """Bodies that are not JSON objects are not scanned."""
+        assert parse_body(b'["model", "stream"]') == (None, False)
+        assert parse_body(b'model=x&"stream": true') == (None, False)
+
+    def test_leading_whitespace_allowed(self) -> None:
+        """Leading JSON whitespace before the object is accepted."""
+        assert parse_body(b'\n  {"model": "m", "stream": true}') == ("m", True)
+
 
 class TestSelectProvider:
     """Tests for select_provider function."""
@@ -192,11 +309,13 @@ class TestSelectProvider:
         mock_logger: GatewayLogger,
     ) -> None:
         """Selects first non-tripped provider."""
-        idx, provider, is_probe = select_provider(
-            sample_providers, breaker_manager, mock_logger
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
         )
-        assert idx == 0
-        assert provider.name == "primary"
+        assert slot.idx == 0
+        assert slot.provider.name == "primary"
         assert is_probe is False
 
     def test_skips_tripped_provider(
@@ -211,10 +330,13 @@ class TestSelectProvider:
         for _ in range(3):
             breaker.record_failure()
 
-        idx, provider, is_probe = select_provider(
-            sample_providers, breaker_manager, mock_logger
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
+            rng=lambda: 0.5,
         )
-        assert provider.name == "backup"
+        assert slot.provider.name == "backup"
         assert is_probe is False
 
     def test_last_provider_never_skipped(
@@ -231,51 +353,52 @@ class TestSelectProvider:
             breaker_manager.get("backup").record_failure()
 
         # Should still get backup since it's last
-        idx, provider, is_probe = select_provider(
-            sample_providers, breaker_manager, mock_logger
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
+            rng=lambda: 0.5,
         )
-        assert provider.name == "backup"
+        assert slot.provider.name == "backup"
 
-    @patch("transparent_gateway.proxy.random.random")
     def test_probe_tripped_provider(
         self,
-        mock_random: Mock,
         sample_providers: list[Provider],
         breaker_manager: CircuitBreakerManager,
         mock_logger: GatewayLogger,
     ) -> None:
         """Probability to probe tripped provider."""
-        mock_random.return_value = 0.01  # < 0.05
-
         # Trip primary
         for _ in range(3):
             breaker_manager.get("primary").record_failure()
 
-        idx, provider, is_probe = select_provider(
-            sample_providers, breaker_manager, mock_logger
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
+            rng=lambda: 0.01,
         )
-        assert provider.name == "primary"
+        assert slot.provider.name == "primary"
         assert is_probe is True
 
-    @patch("transparent_gateway.proxy.random.random")
     def test_no_probe_when_random_high(
         self,
-        mock_random: Mock,
         sample_providers: list[Provider],
         breaker_manager: CircuitBreakerManager,
         mock_logger: GatewayLogger,
     ) -> None:
         """No probe when random value is high."""
-        mock_random.return_value = 0.5  # > 0.05
-
         # Trip primary
         for _ in range(3):
             breaker_manager.get("primary").record_failure()
 
-        idx, provider, is_probe = select_provider(
-            sample_providers, breaker_manager, mock_logger
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
+            rng=lambda: 0.5,
         )
-        assert provider.name == "backup"
+        assert slot.provider.name == "backup"
         assert is_probe is False
 
     def test_custom_probe_probability(
@@ -290,20 +413,94 @@ class TestSelectProvider:
             breaker_manager.get("primary").record_failure()
 
         # With 0% probability, should never probe
-        with patch("transparent_gateway.proxy.random.random", return_value=0.01):
-            idx, provider, is_probe = select_provider(
-                sample_providers, breaker_manager, mock_logger, probe_probability=0.0
-            )
-            assert provider.name == "backup"
-            assert is_probe is False
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
+            probe_probability=0.0,
+            rng=lambda: 0.01,
+        )
+        assert slot.provider.name == "backup"
+        assert is_probe is False
 
         # With 100% probability, should always probe
-        with patch("transparent_gateway.proxy.random.random", return_value=0.5):
-            idx, provider, is_probe = select_provider(
-                sample_providers, breaker_manager, mock_logger, probe_probability=1.0
-            )
-            assert provider.name == "primary"
-            assert is_probe is True
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
+            probe_probability=1.0,
+            rng=lambda: 0.5,
+        )
+        assert slot.provider.name == "primary"
+        assert is_probe is True
+
+    def test_no_dice_roll_when_all_closed(
+        self,
+        sample_providers: list[Provider],
+        breaker_manager: CircuitBreakerManager,
+        mock_logger: GatewayLogger,
+    ) -> None:
+        """With every breaker closed the first slot is chosen without rolling."""
+        rolls: list[float] = []
+        slot, is_probe = select_provider(
+            build_provider_slots(sample_providers, breaker_manager),
+            breaker_manager,
+            mock_logger,
+            probe_probability=1.0,
+            rng=lambda: rolls.append(0.0) or 0.0,
+        )
+        assert slot.provider.name == "primary"
+        assert is_probe is False
+        assert rolls == []
+
+
+class TestGetProviderRoutes:
+    """Tests for get_provider_routes function."""
+
+    def test_binds_breakers_in_order(
+        self, sample_config: Config, breaker_manager: CircuitBreakerManager
+    ) -> None:
+        """Routes pair each provider with its breaker; only the last is fallback."""
+        routes = get_provider_routes(sample_config, breaker_manager)
+        assert [(s.idx, s.provider.name, s.is_last) for s in routes] == [
+            (0, "primary", False),
+            (1, "backup", True),
+        ]
+        assert routes[0].breaker is breaker_manager.get("primary")
+
+    def test_cached_per_config_and_manager(
+        self, sample_config: Config, breaker_manager: CircuitBreakerManager
+    ) -> None:
+        """Same config and manager reuse the table; a new manager rebuilds it."""
+        routes = get_provider_routes(sample_config, breaker_manager)
+        assert get_provider_routes(sample_config, breaker_manager) is routes
+
+        other = CircuitBreakerManager(timeout=60, failure_threshold=3)
+        rebuilt = get_provider_routes(sample_config, other)
+        assert rebuilt is not routes
+        assert rebuilt[0].breaker is other.get("primary")
+
+
+class TestBuildAttemptOrder:
+    """Tests for build_attempt_order function."""
+
+    def test_selected_first_then_remaining(
+        self, sample_config: Config, breaker_manager: CircuitBreakerManager
+    ) -> None:
+        """Selected slot comes first, followed by the others in priority order."""
+        routes = get_provider_routes(sample_config, breaker_manager)
+        order = build_attempt_order(routes, routes[1])
+        assert [s.provider.name for s in order] == ["backup", "primary"]
+
+    def test_skips_open_but_keeps_last(
+        self, sample_config: Config, breaker_manager: CircuitBreakerManager
+    ) -> None:
+        """Open breakers are skipped unless the slot is the fallback provider."""
+        routes = get_provider_routes(sample_config, breaker_manager)
+        breaker_manager.get("primary").trip()
+        breaker_manager.get("backup").trip()
+        assert build_attempt_order(routes, routes[1]) == [routes[1]]
+        assert build_attempt_order(routes, routes[0]) == [routes[0], routes[1]]
 
 
 class TestClassifyError: